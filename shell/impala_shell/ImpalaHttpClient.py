@@ -23,6 +23,8 @@ import datetime
 from io import BytesIO
 import os
 import os.path
+import select
+import socket
 import ssl
 import sys
 import warnings
@@ -46,6 +48,8 @@ Cookie = namedtuple('Cookie', ['cookie', 'expiry_time'])
 # The current changes that have been applied:
 # - Added logic for the 'Expect: 100-continue' header on large requests
 # - If an error code is received back in flush(), an exception is thrown.
+# - The http connection is kept open and reused across flush() calls instead of being
+#   re-established for every request (THRIFT-4600).
 # Note there is a copy of this code in Impyla.
 class ImpalaHttpClient(TTransportBase):
   """Http implementation of TTransport base."""
@@ -182,6 +186,19 @@ class ImpalaHttpClient(TTransportBase):
   def isOpen(self):
     return self.__http is not None
 
+  def isClosedByPeer(self):
+    """Returns whether the server has closed the idle open connection. No request is in
+    flight and the last response was read, so a readable socket means that the server
+    closed it."""
+    sock = getattr(self.__http, 'sock', None)
+    if sock is None:
+      return False
+    try:
+      readable, _, _ = select.select([sock], [], [], 0)
+      return bool(readable)
+    except (select.error, socket.error, ValueError):
+      return True
+
   def setTimeout(self, ms):
     if ms is None:
       self.__timeout = None
@@ -369,13 +386,8 @@ class ImpalaHttpClient(TTransportBase):
     self.__wbuf.write(buf)
 
   def flush(self):
-    # Send HTTP request and receive response.
-    # Return True if the client should retry this method.
-    def sendRequestRecvResp(data):
-      if self.isOpen():
-        self.close()
-      self.open()
-
+    # Send HTTP request and receive response on the current connection.
+    def sendRequest(data):
       # HTTP request
       if self.using_proxy() and self.scheme == "http":
         # need full URL of real host for HTTP proxy here (HTTPS uses CONNECT tunnel)
@@ -386,6 +398,7 @@ class ImpalaHttpClient(TTransportBase):
 
       # Write headers
       self.__http.putheader('Content-Type', 'application/x-thrift')
+      self.__http.putheader('Connection', 'keep-alive')
       data_len = len(data)
       self.__http.putheader('Content-Length', str(data_len))
       if data_len > ImpalaHttpClient.MIN_REQUEST_SIZE_FOR_EXPECT:
@@ -408,12 +421,42 @@ class ImpalaHttpClient(TTransportBase):
         for key, val in six.iteritems(self.__custom_headers):
           self.__http.putheader(key, val)
 
-      self.__http.endheaders()
+      # Write the headers and the payload. Passing the payload to endheaders() lets
+      # Python 2 send both with a single send() call, which avoids the delayed ACK
+      # interaction with Nagle's algorithm. Python 3 sends them separately, but it sets
+      # TCP_NODELAY on the connection.
+      self.__http.endheaders(data)
 
-      # Write payload
-      self.__http.send(data)
-
-      # Get reply to flush the request
+    # Send HTTP request and receive response, reusing the open connection if there is
+    # one. Return True if the client should retry this method.
+    def sendRequestRecvResp(data):
+      reuse_connection = self.isOpen()
+      if not reuse_connection:
+        self.open()
+      try:
+        # The previous response must be fully read before the connection can be reused.
+        if self.__http_response is not None and not self.__http_response.isclosed():
+          self.__http_response.read()
+        if reuse_connection and self.isClosedByPeer():
+          # The server closed the idle keep-alive connection between two requests.
+          self.close()
+          self.open()
+          reuse_connection = False
+        sendRequest(data)
+      except socket.timeout:
+        raise
+      except (http_client.HTTPException, socket.error):
+        if not reuse_connection:
+          raise
+        # The server may have closed the idle keep-alive connection. The request did not
+        # make it to the server, so reconnect once and send it again.
+        self.close()
+        self.open()
+        reuse_connection = False
+        sendRequest(data)
+      # Get reply to flush the request. Errors from here on may happen after the server
+      # ran the request, and resending it could run a non-idempotent RPC twice, so they
+      # are raised and left to the RPC level retry policy.
       self.__http_response = self.__http.getresponse()
       self.code = self.__http_response.status
       self.message = self.__http_response.reason
@@ -20,26 +20,24 @@
 from __future__ import absolute_import, print_function, unicode_literals
 import base64
 from datetime import datetime
-import operator
+from operator import attrgetter
+import random
 import re
+import select
 import socket
-import ssl
+import struct
 import sys
+import threading
 import time
 import traceback
 import uuid
 
-from bitarray import bitarray
-import sasl
 from thrift.protocol import TBinaryProtocol
 from thrift.Thrift import TApplicationException, TException
 from thrift.transport.TSocket import TSocket
 from thrift.transport.TTransport import TBufferedTransport, TTransportException
-from thrift_sasl import TSaslClientTransport
 
-from impala_shell.compatibility import _xrange as xrange
 from impala_shell.exec_summary import build_exec_summary_table
-from impala_shell.ImpalaHttpClient import ImpalaHttpClient
 from impala_shell.kerberos_util import get_kerb_host_from_kerberos_host_fqdn
 from impala_shell.shell_exceptions import (
     DisconnectedException,
@@ -61,7 +59,6 @@ from impala_thrift_gen.ImpalaService.ImpalaHiveServer2Service import (
     TGetRuntimeProfileReq,
     TPingImpalaHS2ServiceReq,
 )
-from impala_thrift_gen.Status.ttypes import TStatus
 from impala_thrift_gen.TCLIService.TCLIService import (
     TCancelOperationReq,
     TCloseOperationReq,
@@ -79,50 +76,114 @@ from impala_thrift_gen.TCLIService.TCLIService import (
     TTypeId,
 )
 
-# Getters to extract HS2's representation of values to the display version.
-# An entry must be added to this map for each supported type. HS2's TColumn has many
-# different typed field, each of which has a 'values' and a 'nulls' field. These getters
-# extract the appropriate member from TColumn for the given TTypeId.
-HS2_VALUE_GETTERS = {
-    TTypeId.BOOLEAN_TYPE: operator.attrgetter('boolVal'),
-    TTypeId.TINYINT_TYPE: operator.attrgetter('byteVal'),
-    TTypeId.SMALLINT_TYPE: operator.attrgetter('i16Val'),
-    TTypeId.INT_TYPE: operator.attrgetter('i32Val'),
-    TTypeId.BIGINT_TYPE: operator.attrgetter('i64Val'),
-    TTypeId.TIMESTAMP_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.FLOAT_TYPE: operator.attrgetter('doubleVal'),
-    TTypeId.DOUBLE_TYPE: operator.attrgetter('doubleVal'),
-    TTypeId.STRING_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.DECIMAL_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.BINARY_TYPE: operator.attrgetter('binaryVal'),
-    TTypeId.VARCHAR_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.CHAR_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.MAP_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.ARRAY_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.STRUCT_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.UNION_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.NULL_TYPE: operator.attrgetter('stringVal'),
-    TTypeId.DATE_TYPE: operator.attrgetter('stringVal')
-}
-
-
-# Helper to decode utf8 encoded str to unicode type in Python 2. NOOP in Python 3.
-def utf8_decode_if_needed(val):
-  if sys.version_info.major < 3 and isinstance(val, str):
-    val = val.decode('utf-8', errors='replace')
-  return val
-
-
-# Helper to decode unicode to utf8 encoded str in Python 2. NOOP in Python 3.
-def utf8_encode_if_needed(val):
-  if sys.version_info.major < 3 and isinstance(val, unicode):  # noqa: F821
-    val = val.encode('utf-8', errors='replace')
-  return val
-
+# Names of the TColumn fields that hold HS2's representation of values, indexed by
+# TTypeId. An entry must be added to this table for each supported type. HS2's TColumn
+# has many different typed field, each of which has a 'values' and a 'nulls' field.
+# Indexing by the small integer TTypeId avoids a dict lookup and an attrgetter call for
+# every column of every batch.
+HS2_VALUE_ATTRS = [None] * (max(TTypeId._VALUES_TO_NAMES) + 1)
+HS2_VALUE_ATTRS[TTypeId.BOOLEAN_TYPE] = 'boolVal'
+HS2_VALUE_ATTRS[TTypeId.TINYINT_TYPE] = 'byteVal'
+HS2_VALUE_ATTRS[TTypeId.SMALLINT_TYPE] = 'i16Val'
+HS2_VALUE_ATTRS[TTypeId.INT_TYPE] = 'i32Val'
+HS2_VALUE_ATTRS[TTypeId.BIGINT_TYPE] = 'i64Val'
+HS2_VALUE_ATTRS[TTypeId.TIMESTAMP_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.FLOAT_TYPE] = 'doubleVal'
+HS2_VALUE_ATTRS[TTypeId.DOUBLE_TYPE] = 'doubleVal'
+HS2_VALUE_ATTRS[TTypeId.STRING_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.DECIMAL_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.BINARY_TYPE] = 'binaryVal'
+HS2_VALUE_ATTRS[TTypeId.VARCHAR_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.CHAR_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.MAP_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.ARRAY_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.STRUCT_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.UNION_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.NULL_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS[TTypeId.DATE_TYPE] = 'stringVal'
+HS2_VALUE_ATTRS = tuple(HS2_VALUE_ATTRS)
+
+# Getters for the column names in HS2 (TColumnDesc) and Beeswax (FieldSchema) result
+# schemas.
+get_column_name = attrgetter('columnName')
+get_field_schema_name = attrgetter('name')
+
+
+# True if running under Python 2. Checked once here so that the per-query helpers below
+# don't need to look at sys.version_info on every call.
+IS_PY2 = sys.version_info.major < 3
+
+if IS_PY2:
+  # Helper to decode utf8 encoded str to unicode type in Python 2. NOOP in Python 3.
+  def utf8_decode_if_needed(val):
+    if isinstance(val, str):
+      val = val.decode('utf-8', errors='replace')
+    return val
+
+  # Helper to decode unicode to utf8 encoded str in Python 2. NOOP in Python 3.
+  def utf8_encode_if_needed(val):
+    if isinstance(val, unicode):  # noqa: F821
+      val = val.encode('utf-8', errors='replace')
+    return val
+else:
+  def utf8_decode_if_needed(val):
+    return val
+
+  def utf8_encode_if_needed(val):
+    return val
+
+
+# Prefixes of the logs returned by _get_warn_or_error_log(), indexed by 'warn'.
+WARN_OR_ERROR_LOG_PREFIX = {True: "WARNINGS: ", False: "ERROR: "}
+# Messages returned by _get_warn_or_error_log() if the log cannot be fetched, indexed by
+# 'warn'.
+FAILED_WARN_OR_ERROR_LOG_FORMAT = {True: "Failed to get warn log: %s",
+                                   False: "Failed to get error log: %s"}
+# Format of the RPCException message for a BeeswaxException. The message of the
+# exception is utf8 encoded in Python 2, so the format is encoded to match.
+BEESWAX_EXCEPTION_FORMAT = utf8_encode_if_needed("ERROR: %s")
+
+
+# The statement types, identified by their (three letter) first word, for which Beeswax
+# does not return result metadata.
+BEESWAX_NO_METADATA_QUERY_TYPES = frozenset(['use'])
 
 # Regular expression that matches the progress line added to HS2 logs by
 # the Impala server.
 HS2_LOG_PROGRESS_REGEX = re.compile(r"Query.*Complete \([0-9]* out of [0-9]*\)\n")
+# Literal text that every match of HS2_LOG_PROGRESS_REGEX contains.
+HS2_LOG_PROGRESS_MARKER = "Complete ("
+
+# Regular expression that extracts the id of the retried query from a query log.
+LOG_RETRIED_QUERY_REGEX = re.compile(r"Query has been retried using query id: (.*)\n")
+
+# Format of the timestamps printed by log_exception_with_timestamp() and log_timestamp().
+LOG_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _format_log_timestamp():
+  # strftime() defaults to the current local time.
+  return time.strftime(LOG_TIMESTAMP_FORMAT)
+
+
+# The bitarray class. bitarray is only needed to decode HS2 result sets, so it is
+# imported by _get_bitarray_class() on first use rather than when the shell starts.
+_bitarray_class = None
+
+
+def _get_bitarray_class():
+  """Returns the bitarray class, importing the module the first time."""
+  global _bitarray_class
+  if _bitarray_class is None:
+    from bitarray import bitarray
+    _bitarray_class = bitarray
+  return _bitarray_class
+
+
+# Monotonic high resolution clock used to time traced RPCs and the liveness grace
+# period, which must not be affected by wall clock changes. Python 2 lacks
+# time.perf_counter().
+perf_counter = getattr(time, "perf_counter", time.time)
 
 # Exception types to differentiate between the different RPCExceptions.
 # RPCException raised when TApplicationException is caught.
@@ -150,23 +211,80 @@ class QueryOptionLevels:
     return cls.NAME_TO_VALUES.get(string.upper(), cls.DEVELOPMENT)
 
 
+class ColumnBatch(object):
+  """A batch of result rows returned by ImpalaHS2Client.fetch(), stored as one list of
+  display values per column. The rows are only assembled when the batch is iterated,
+  and each iteration yields them as new lists that the caller may modify."""
+  def __init__(self, columns, num_rows):
+    self.columns = columns
+    self.num_rows = num_rows
+
+  def __len__(self):
+    return self.num_rows
+
+  def __iter__(self):
+    return iter(map(list, zip(*self.columns)))
+
+
+class BackgroundCall(object):
+  """Runs fn(*args) in a daemon thread. result() waits for the call to finish and
+  returns its return value or re-raises its exception."""
+  def __init__(self, fn, *args):
+    self._fn = fn
+    self._args = args
+    self._result = None
+    self._exception = None
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _run(self):
+    try:
+      self._result = self._fn(*self._args)
+    except BaseException as e:
+      self._exception = e
+
+  def wait(self):
+    """Waits for the call to finish. Joins with a timeout so that the wait can be
+    interrupted by signals on Python 2 as well."""
+    while self._thread.is_alive():
+      self._thread.join(1)
+
+  def result(self):
+    self.wait()
+    if self._exception is not None:
+      raise self._exception
+    return self._result
+
+
 class ImpalaClient(object):
   """Base class for shared functionality between HS2 and Beeswax. Includes stub methods
   for methods that are expected to be implemented in the subclasses.
   TODO: when beeswax support is removed, merge this with ImpalaHS2Client."""
+  # is_connected() assumes that the connection is still alive, without pinging the
+  # server, if an RPC succeeded less than this many seconds ago.
+  IS_CONNECTED_GRACE_PERIOD_S = 1.0
+
   def __init__(self, impalad, fetch_size, kerberos_host_fqdn, use_kerberos=False,
                kerberos_service_name="impala", use_ssl=False, ca_cert=None, user=None,
                ldap_password=None, use_ldap=False, client_connect_timeout_ms=60000,
                verbose=True, use_http_base_transport=False, http_path=None,
                http_cookie_names=None, http_socket_timeout_s=None, value_converter=None,
                connect_max_tries=4, rpc_stdout=False, rpc_file=None, http_tracing=True,
-               jwt=None, oauth=None, hs2_x_forward=None):
+               jwt=None, oauth=None, hs2_x_forward=None, max_coalesced_fetches=4,
+               read_buffer_size=1 << 20, prefetch_next_batch=True):
     self.connected = False
     self.impalad_host = impalad[0]
     self.impalad_port = int(impalad[1])
+    # The "host:port" string of the impalad, with ipv6 addresses wrapped in brackets.
+    self._host_port = self._to_host_port(self.impalad_host, self.impalad_port)
     self.kerberos_host_fqdn = kerberos_host_fqdn
     self.imp_service = None
     self.transport = None
+    # The socket underlying self.transport. Only set for the binary (non-http) transport.
+    self._socket = None
+    # The perf_counter() at which the last RPC to the server completed successfully.
+    self._last_successful_rpc_time = None
     self.use_kerberos = use_kerberos
     self.kerberos_service_name = kerberos_service_name
     self.use_ssl = use_ssl
@@ -179,6 +297,16 @@ class ImpalaClient(object):
     self.default_query_options = {}
     self.query_option_levels = {}
     self.fetch_size = fetch_size
+    # Maximum number of follow-up fetch RPCs issued to fill up a batch when the server
+    # returns far fewer rows than self.fetch_size. 0 disables coalescing.
+    self.max_coalesced_fetches = max_coalesced_fetches
+    # Size in bytes of the read buffer of the TBufferedTransport wrapping the socket or
+    # the http client. A large buffer lets a result batch be read with few recv() calls.
+    self.read_buffer_size = read_buffer_size
+    # If True, HS2 fetch() requests the next batch in a background thread while the
+    # caller processes the current one, which hides the round trip. Only done for the
+    # callers of fetch() that pass prefetch_next_batch=True.
+    self.prefetch_next_batch = prefetch_next_batch
     self.use_http_base_transport = use_http_base_transport
     self.http_path = http_path
     self.http_cookie_names = http_cookie_names
@@ -196,6 +324,8 @@ class ImpalaClient(object):
     self.value_converter = value_converter
     self.rpc_stdout = rpc_stdout
     self.rpc_file = rpc_file
+    # The handle of rpc_file, opened on first use and closed with the connection.
+    self._rpc_file_handle = None
     # In h2s-http clients only, the value of the X-Forwarded-For http header.
     self.hs2_x_forward = hs2_x_forward
 
@@ -209,11 +339,12 @@ class ImpalaClient(object):
         self.transport = self._get_http_transport(self.client_connect_timeout_ms)
     else:
         self.transport = self._get_transport(self.client_connect_timeout_ms)
-    assert self.transport and self.transport.isOpen()
+    if not (self.transport and self.transport.isOpen()):
+      raise DisconnectedException("Failed to open a connection to {0}"
+                                  .format(self._host_port))
 
     if self.verbose:
-      msg = 'Opened TCP connection to %s:%s' % (self.impalad_host, self.impalad_port)
-      print(msg, file=sys.stderr)
+      sys.stderr.write("Opened TCP connection to {0}\n".format(self._host_port))
     protocol = TBinaryProtocol.TBinaryProtocolAccelerated(self.transport)
     self.imp_service = self._get_thrift_client(protocol)
     self.connected = True
@@ -239,8 +370,16 @@ class ImpalaClient(object):
     """Returns True if the current Impala connection is alive and False otherwise."""
     if not self.connected:
       return False
+    last_rpc_time = self._last_successful_rpc_time
+    if (last_rpc_time is not None
+        and perf_counter() - last_rpc_time < self.IS_CONNECTED_GRACE_PERIOD_S):
+      return True
+    if self._is_socket_closed_by_peer():
+      self.close_connection()
+      return False
     try:
       self._ping_impala_service()
+      self._last_successful_rpc_time = perf_counter()
       return True
       # Catch exceptions that are associated with communication errors.
     except TException:
@@ -257,13 +396,41 @@ class ImpalaClient(object):
     """Close any open sessions and close the connection if still open."""
     raise NotImplementedError()
 
+  def close_query_and_connection(self, last_query_handle):
+    """Close the query handle, like close_query(), and then the connection, like
+    close_connection(). The connection is closed even if closing the query fails.
+    Returns True if the query was closed successfully or False otherwise."""
+    try:
+      return self.close_query(last_query_handle)
+    finally:
+      self.close_connection()
+
   def _close_transport(self):
     """Closes transport if not closed and set self.connected to False. This is the last
     step of close_connection()."""
     if self.transport and self.transport.isOpen():
       self.transport.close()
+    self._socket = None
+    self._last_successful_rpc_time = None
+    if self._rpc_file_handle is not None:
+      self._rpc_file_handle.close()
+      self._rpc_file_handle = None
     self.connected = False
 
+  def _is_socket_closed_by_peer(self):
+    """Cheaply checks whether the server has closed the socket of a binary connection,
+    without sending an RPC. Returns False if the check isn't possible (http and ssl
+    connections), so that callers fall back to pinging the server."""
+    handle = getattr(self._socket, 'handle', None)
+    if handle is None or self.use_ssl:
+      return False
+    try:
+      # No RPC is in flight, so a readable socket means that the server closed it.
+      readable, _, _ = select.select([handle], [], [], 0)
+      return bool(readable) and not handle.recv(1, socket.MSG_PEEK)
+    except (select.error, socket.error):
+      return True
+
   def _ping_impala_service(self):
     """Pings the Impala service to ensure it can receive RPCs. Returns a tuple with
     the impala version string and the webserver address. Raise TException, RPCException,
@@ -293,7 +460,7 @@ class ImpalaClient(object):
     query encounters an error or is cancelled. Raises an exception if the query
     encounters an error or is cancelled or if we lose connection to the impalad.
     If 'periodic_callback' is provided, it is called periodically with no arguments."""
-    loop_start = time.time()
+    num_polls = 0
     while True:
       start_rpc_time = time.time()
       query_state = self.get_query_state(last_query_handle)
@@ -308,7 +475,8 @@ class ImpalaClient(object):
           raise DisconnectedException("Not connected to impalad.")
 
       if periodic_callback is not None: periodic_callback()
-      sleep_time = self._get_sleep_interval(loop_start)
+      sleep_time = self._get_sleep_interval(num_polls)
+      num_polls += 1
       if rpc_time < sleep_time:
         time.sleep(sleep_time - rpc_time)
 
@@ -326,11 +494,15 @@ class ImpalaClient(object):
     """Given a query string and handle, return True if impalad expects result metadata."""
     raise NotImplementedError()
 
-  def fetch(self, query_handle):
-    """Returns an iterable of batches of result rows. Each batch is an iterable of rows.
-    Each row is an iterable of strings in the format in which they should be displayed
+  def fetch(self, query_handle, prefetch_next_batch=False):
+    """Returns an iterable of batches of result rows. Each batch is an iterable of rows
+    that also supports len(). Each row is a list of strings in the format in which
+    they should be displayed.
     Tries to ensure that the batches have a granularity of self.fetch_size but
     does not guarantee it.
+    If 'prefetch_next_batch' is true, the client may fetch the next batch while the
+    caller processes the current one. The caller must then not use the client until
+    the iteration ends or it closes the returned generator.
     """
     """Returns an iterable of batches of result rows up to self.fetch_size. Does
     not need to consolidate those batches into larger batches."""
@@ -395,11 +567,21 @@ class ImpalaClient(object):
     (e.g. warnings)."""
     return self._get_warn_or_error_log(last_query_handle, False)
 
+  def get_warning_log_and_close_query(self, last_query_handle):
+    """Fetches the warning log for last_query_handle, like get_warning_log(), and then
+    closes the query, like close_query(). Returns a tuple of the warning log and the
+    time.time() at which it was received, which lets callers time the query without
+    the close. Clients that can fetch the log and close the query in a single round
+    trip override this."""
+    warning_log = self.get_warning_log(last_query_handle)
+    log_time = time.time()
+    self.close_query(last_query_handle)
+    return warning_log, log_time
+
   def _append_retried_query_link(self, get_log_result):
     """Append the retried query link if the original query has been retried"""
     if self.webserver_address:
-      query_id_search = re.search("Query has been retried using query id: (.*)\n",
-                                  get_log_result)
+      query_id_search = LOG_RETRIED_QUERY_REGEX.search(get_log_result)
       if query_id_search and len(query_id_search.groups()) >= 1:
         retried_query_id = query_id_search.group(1)
         get_log_result += "Retried query link: %s" % \
@@ -408,17 +590,21 @@ class ImpalaClient(object):
 
   def _get_http_transport(self, connect_timeout_ms):
     """Creates a transport with HTTP as the base."""
+    # The http transport and the ssl module are only imported when an http connection
+    # is requested, to keep them off the startup path of the other protocols.
+    import ssl
+    from impala_shell.ImpalaHttpClient import ImpalaHttpClient
     # Older python versions do not support SSLContext needed by ImpalaHttpClient. More
     # context in IMPALA-8864. CentOs 6 ships such an incompatible python version
     # out of the box.
     if not hasattr(ssl, "create_default_context"):
       print("Python version too old. SSLContext not supported.", file=sys.stderr)
       raise NotImplementedError()
-    # Current implementation of ImpalaHttpClient does a close() and open() of the
-    # underlying http connection on every flush() (THRIFT-4600). Due to this, setting a
-    # connect timeout does not achieve the desirable result as the subsequent open() could
-    # block similary in case of problematic remote end points.
-    # TODO: Investigate connection reuse in ImpalaHttpClient and revisit this.
+    # ImpalaHttpClient keeps the underlying http connection open across flush() calls,
+    # but transparently re-opens it if the server closes it or a request fails. Due to
+    # this, setting a connect timeout does not achieve the desirable result as the
+    # subsequent open() could block similary in case of problematic remote end points.
+    # TODO: Apply the connect timeout to connections re-opened in ImpalaHttpClient.
     if connect_timeout_ms > 0 and self.verbose:
       print("Warning: --connect_timeout_ms is currently ignored with HTTP transport.",
             file=sys.stderr)
@@ -429,7 +615,6 @@ class ImpalaClient(object):
     # symptoms in case of a problematic remote endpoint. It's better to have a finite
     # timeout so that in case of any connection errors, the client retries have a better
     # chance of succeeding.
-    host_and_port = self._to_host_port(self.impalad_host, self.impalad_port)
     assert self.http_path
     # ImpalaHttpClient relies on the URI scheme (http vs https) to open an appropriate
     # connection to the server.
@@ -440,13 +625,13 @@ class ImpalaClient(object):
       else:
         ssl_ctx.check_hostname = False  # Mandated by the SSL lib for CERT_NONE mode.
         ssl_ctx.verify_mode = ssl.CERT_NONE
-      url = "https://{0}/{1}".format(host_and_port, self.http_path)
+      url = "https://{0}/{1}".format(self._host_port, self.http_path)
       transport = ImpalaHttpClient(url, ssl_context=ssl_ctx,
                                    http_cookie_names=self.http_cookie_names,
                                    socket_timeout_s=self.http_socket_timeout_s,
                                    verbose=self.verbose)
     else:
-      url = "http://{0}/{1}".format(host_and_port, self.http_path)
+      url = "http://{0}/{1}".format(self._host_port, self.http_path)
       transport = ImpalaHttpClient(url, http_cookie_names=self.http_cookie_names,
                                    socket_timeout_s=self.http_socket_timeout_s,
                                    verbose=self.verbose)
@@ -479,7 +664,7 @@ class ImpalaClient(object):
 
     # Without buffering Thrift would call socket.recv() each time it deserializes
     # something (e.g. a member in a struct).
-    transport = TBufferedTransport(transport)
+    transport = TBufferedTransport(transport, rbuf_size=self.read_buffer_size)
     transport.open()
     return transport
 
@@ -526,6 +711,7 @@ class ImpalaClient(object):
 
     # Helper to initialize a sasl client
     def sasl_factory():
+      import sasl
       sasl_client = sasl.Client()
       sasl_client.setAttr("host", sasl_host)
       if self.use_ldap:
@@ -538,31 +724,44 @@ class ImpalaClient(object):
 
     transport = None
     if not (self.use_ldap or self.use_kerberos):
-      transport = TBufferedTransport(sock)
-    # GSSASPI is  the underlying mechanism used by kerberos to authenticate.
-    elif self.use_kerberos:
-      transport = TSaslClientTransport(sasl_factory, "GSSAPI", sock)
+      transport = TBufferedTransport(sock, rbuf_size=self.read_buffer_size)
     else:
-      transport = TSaslClientTransport(sasl_factory, "PLAIN", sock)
+      # The sasl modules load compiled extensions, so they are only imported when
+      # LDAP or Kerberos authentication is requested.
+      from thrift_sasl import TSaslClientTransport
+      # GSSASPI is  the underlying mechanism used by kerberos to authenticate.
+      if self.use_kerberos:
+        transport = TSaslClientTransport(sasl_factory, "GSSAPI", sock)
+      else:
+        transport = TSaslClientTransport(sasl_factory, "PLAIN", sock)
     # Open the transport and reset the timeout so that it does not apply to the
     # subsequent RPCs on the same socket.
     transport.open()
     sock.setTimeout(None)
+    # Thrift writes each message with a single send(), but back-to-back messages (see
+    # close_query_and_connection()) would otherwise be delayed by Nagle's algorithm
+    # until the previous one is acknowledged. Keepalives stop firewalls and NATs from
+    # silently dropping the connection while the shell is idle, which would cost a
+    # reconnect, including the SASL handshake, before the next query.
+    try:
+      sock.handle.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      sock.handle.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    except socket.error:
+      # Not all platforms support these options. They are only optimizations.
+      pass
+    self._socket = sock
     return transport
 
   def build_summary_table(self, summary, output):
     build_exec_summary_table(summary, 0, 0, False, output, is_prettyprint=True,
                              separate_prefix_column=False)
 
-  def _get_sleep_interval(self, start_time):
-    """Returns a step function of time to sleep in seconds before polling
-    again. Maximum sleep is 1s, minimum is 0.1s"""
-    elapsed = time.time() - start_time
-    if elapsed < 10.0:
-      return 0.1
-    elif elapsed < 60.0:
-      return 0.5
-    return 1.0
+  def _get_sleep_interval(self, num_polls):
+    """Returns the time to sleep in seconds before polling again after 'num_polls'
+    previous polls. The interval grows exponentially from 10ms so that short queries
+    are noticed quickly, is capped at 1s so that long queries do not issue many
+    wasted RPCs, and is jittered so that concurrent shells do not poll in lockstep."""
+    return min(1.0, 0.01 * 2 ** min(num_polls, 7)) * (0.5 + random.random() / 2)
 
   def _check_connected(self):
     """Raise DiconnectedException if the client is not connected."""
@@ -575,10 +774,12 @@ class ImpalaClient(object):
     return None
 
   def _process_dml_result(self, dml_result):
-    num_rows = sum([int(k) for k in dml_result.rows_modified.values()])
+    # The per-partition counts in TDmlResult are i64s, which thrift already decodes to
+    # Python ints, so they can be summed directly by the C-implemented sum().
+    num_rows = sum(dml_result.rows_modified.values())
     num_deleted_rows = None
     if dml_result.rows_deleted:
-      num_deleted_rows = sum([int(k) for k in dml_result.rows_deleted.values()])
+      num_deleted_rows = sum(dml_result.rows_deleted.values())
     return (num_rows, num_deleted_rows, dml_result.num_row_errors)
 
   @staticmethod
@@ -591,6 +792,14 @@ class ImpalaClient(object):
 
 class ImpalaHS2Client(ImpalaClient):
   """Impala client. Uses the HS2 protocol plus Impala-specific extensions."""
+  # The maximum number of rows requested by the first FetchResults RPC of a query. Later
+  # fetches double the number of rows requested, up to self.fetch_size.
+  INITIAL_FETCH_SIZE = 1024
+  # Follow-up fetches that fill up a small batch hold back the rows that already arrived,
+  # so no more of them are issued once this many seconds passed since the batch's first
+  # response. This keeps the output flowing when the server produces rows slowly.
+  MAX_COALESCE_TIME_S = 0.1
+
   def __init__(self, *args, **kwargs):
     super(ImpalaHS2Client, self).__init__(*args, **kwargs)
     self.FINISHED_STATE = TOperationState._NAMES_TO_VALUES["FINISHED_STATE"]
@@ -607,8 +816,9 @@ class ImpalaHS2Client(ImpalaClient):
       self.max_tries = self.connect_max_tries
     else:
       self.max_tries = 1
-    # Minimum sleep interval between retry attempts.
+    # Minimum and maximum sleep interval between retry attempts.
     self.min_sleep_interval = 1
+    self.max_sleep_interval = 30
 
     # In case of direct instantiation of the client where the converter is
     # not set, there should be a default value converter assigned
@@ -618,16 +828,46 @@ class ImpalaHS2Client(ImpalaClient):
     if self.rpc_stdout or self.rpc_stdout is not None:
       self.thrift_printer = ThriftPrettyPrinter()
 
-    self._base_request_id = str(uuid.uuid1())
+    # Per-RPC request ids are built by appending a counter to this prefix, which is
+    # generated once per client.
+    self._base_request_id = str(uuid.uuid1()) + "-"
     self._request_num = 0
+    # The request id of the RPC in progress, set by _do_hs2_rpc().
+    self._current_request_id = None
+    # get_query_state() is called in a loop while waiting for a query, so it reuses
+    # one request object and only updates its operation handle.
+    self._get_operation_status_req = TGetOperationStatusReq()
+    # Likewise for get_summary(), which the live progress and summary callbacks call
+    # periodically while a query runs.
+    self._get_exec_summary_req = TGetExecSummaryReq(include_query_attempts=True)
+
+    # Cache of the http headers returned by get_custom_http_headers() that only depend
+    # on the session and the current query handle.
+    self._http_headers_cache = None
+    self._http_headers_session_handle = None
+    self._http_headers_query_handle = None
 
   def _get_thrift_client(self, protocol):
     return ImpalaHiveServer2Service.Client(protocol)
 
   def _get_sleep_interval_for_retries(self, num_tries):
-    """Returns the sleep interval in seconds for the 'num_tries' retry attempt."""
+    """Returns the sleep interval in seconds for the 'num_tries' retry attempt. The
+    first retry is immediate. Later ones back off exponentially, up to
+    self.max_sleep_interval, and are jittered so that many shells that lost their
+    connection at the same time do not retry in lockstep."""
     assert num_tries > 0 and num_tries < self.max_tries
-    return self.min_sleep_interval * (num_tries - 1)
+    if num_tries == 1:
+      return 0
+    interval = min(self.max_sleep_interval,
+                   self.min_sleep_interval * 2 ** (num_tries - 2))
+    return interval * (0.5 + random.random() / 2)
+
+  def _get_retry_msg(self, num_tries, max_tries):
+    """Returns the message logged with an error on try 'num_tries' out of 'max_tries'.
+    Only called once an error happened, so successful RPCs don't pay to format it."""
+    if max_tries > 1:
+      return 'Num remaining tries: {0}'.format(max_tries - num_tries)
+    return ''
 
   def _open_session(self):
     def OpenSession(req):
@@ -647,22 +887,30 @@ class ImpalaHS2Client(ImpalaClient):
     self._populate_query_options()
 
   def get_custom_http_headers(self):
-    headers = {}
-
+    # Only the request id changes on every RPC. The other headers are rebuilt only when
+    # the session or the current query handle changes.
+    if (self._http_headers_cache is None
+        or self.session_handle is not self._http_headers_session_handle
+        or self._current_query_handle is not self._http_headers_query_handle):
+      headers_cache = {}
+      if self.http_tracing:
+        session_id = self.get_session_id()
+        if session_id is not None:
+          headers_cache["X-Impala-Session-Id"] = session_id
+
+        current_query_id = self.get_query_id_str(self._current_query_handle)
+        if current_query_id is not None:
+          headers_cache["X-Impala-Query-Id"] = current_query_id
+      if self.hs2_x_forward:
+        headers_cache["X-Forwarded-For"] = self.hs2_x_forward
+      self._http_headers_cache = headers_cache
+      self._http_headers_session_handle = self.session_handle
+      self._http_headers_query_handle = self._current_query_handle
+
+    headers = dict(self._http_headers_cache)
     if self.http_tracing:
-      session_id = self.get_session_id()
-      if session_id is not None:
-        headers["X-Impala-Session-Id"] = session_id
-
-      current_query_id = self.get_query_id_str(self._current_query_handle)
-      if current_query_id is not None:
-        headers["X-Impala-Query-Id"] = current_query_id
-
-      assert getattr(self, "_current_request_id", None) is not None, \
-        "request id was not set"
+      assert self._current_request_id is not None, "request id was not set"
       headers["X-Request-Id"] = self._current_request_id
-    if self.hs2_x_forward:
-      headers["X-Forwarded-For"] = self.hs2_x_forward
 
     return headers
 
@@ -685,6 +933,42 @@ class ImpalaHS2Client(ImpalaClient):
       self.session_handle = None
     self._close_transport()
 
+  def close_query_and_connection(self, last_query_handle):
+    if (self.use_http_base_transport or self.session_handle is None
+        or last_query_handle.is_closed):
+      return super(ImpalaHS2Client, self).close_query_and_connection(last_query_handle)
+    # On the binary transport both requests are written to the socket before either
+    # response is read, which saves a round trip. The server handles the requests of a
+    # connection in order, so the responses arrive in the same order. Http requests
+    # cannot be pipelined like this.
+
+    def CloseImpalaOperationAndSession(reqs):
+      close_op_req, close_session_req = reqs
+      self.imp_service.send_CloseImpalaOperation(close_op_req)
+      self.imp_service.send_CloseSession(close_session_req)
+      return (self.imp_service.recv_CloseImpalaOperation(),
+              self.imp_service.recv_CloseSession())
+    try:
+      self._set_current_query_handle(last_query_handle)
+      reqs = (TCloseImpalaOperationReq(last_query_handle),
+              TCloseSessionReq(self.session_handle))
+      # Not retried, since the stream is in an unknown state after a partial failure.
+      # The server closes the session, and with it the query, when the connection is
+      # closed below.
+      close_op_resp, close_session_resp = \
+          self._do_hs2_rpc(CloseImpalaOperationAndSession, reqs)
+      last_query_handle.is_closed = True
+      try:
+        self._check_hs2_rpc_status(close_session_resp.status)
+      except Exception as e:
+        log_exception_with_timestamp(e, "Warning",
+           "close session RPC failed: {0}".format(type(e)), stderr_flag=False)
+      return self._is_hs2_nonerror_status(close_op_resp.status.statusCode)
+    finally:
+      self._clear_current_query_handle()
+      self.session_handle = None
+      self._close_transport()
+
   def _populate_query_options(self):
     # List all of the query options and their levels.
     # Retrying "set all" should be idempotent
@@ -692,18 +976,21 @@ class ImpalaHS2Client(ImpalaClient):
     while num_tries <= self.max_tries:
       raise_error = (num_tries == self.max_tries)
       set_all_handle = None
-      if self.max_tries > 1:
-        retry_msg = 'Num remaining tries: {0}'.format(self.max_tries - num_tries)
-      else:
-        retry_msg = ''
       try:
         set_all_handle = self.execute_query("set all", {})
         self.default_query_options = {}
         self.query_option_levels = {}
+        # There are hundreds of options but only a handful of distinct levels.
+        level_values = {}
         for rows in self.fetch(set_all_handle):
           for name, value, level in rows:
-            self.default_query_options[name.upper()] = value
-            self.query_option_levels[name.upper()] = QueryOptionLevels.from_string(level)
+            name = name.upper()
+            self.default_query_options[name] = value
+            level_value = level_values.get(level)
+            if level_value is None:
+              level_value = QueryOptionLevels.from_string(level)
+              level_values[level] = level_value
+            self.query_option_levels[name] = level_value
         break
       except (QueryCancelledByShellException, MissingThriftMethodException,
         QueryStateException):
@@ -713,12 +1000,14 @@ class ImpalaHS2Client(ImpalaClient):
             or r.exception_type == RPC_EXCEPTION_SERVER):
           raise
         log_exception_with_timestamp(r, "Exception",
-           "type={0} when listing query options. {1}".format(type(r), retry_msg))
+           "type={0} when listing query options. {1}".format(
+             type(r), self._get_retry_msg(num_tries, self.max_tries)))
         if raise_error:
           raise
       except Exception as e:
         log_exception_with_timestamp(e, "Exception",
-           "type={0} when listing query options. {1}".format(type(e), retry_msg))
+           "type={0} when listing query options. {1}".format(
+             type(e), self._get_retry_msg(num_tries, self.max_tries)))
         if raise_error:
           raise
       finally:
@@ -739,13 +1028,13 @@ class ImpalaHS2Client(ImpalaClient):
     return (resp.version, resp.webserver_address)
 
   def _create_query_req(self, query_str, set_query_options):
-    conf_overlay = {}
-    if sys.version_info.major < 3:
-      key_value_pairs = set_query_options.iteritems()
+    if IS_PY2:
+      conf_overlay = {}
+      for k, v in set_query_options.iteritems():
+        conf_overlay[utf8_encode_if_needed(k)] = utf8_encode_if_needed(v)
     else:
-      key_value_pairs = set_query_options.items()
-    for k, v in key_value_pairs:
-      conf_overlay[utf8_encode_if_needed(k)] = utf8_encode_if_needed(v)
+      # The options don't need to be encoded in Python 3, so copy them in one go.
+      conf_overlay = dict(set_query_options)
     query = TExecuteStatementReq(sessionHandle=self.session_handle,
         statement=utf8_encode_if_needed(query_str),
         confOverlay=conf_overlay, runAsync=True)
@@ -780,8 +1069,16 @@ class ImpalaHS2Client(ImpalaClient):
         resp = self._do_hs2_rpc(GetResultSetMetadata, req, retry_on_error=True)
         self._check_hs2_rpc_status(resp.status)
         assert resp.schema is not None, resp
-        # Attach the schema to the handle for convenience.
+        # Attach the schema to the handle for convenience, along with the TColumn field
+        # names and converters that fetch() needs for its columns.
         handle.schema = resp.schema
+        prim_types = [column.typeDesc.types[0].primitiveEntry.type
+                      for column in resp.schema.columns]
+        handle.column_value_attrs = tuple(HS2_VALUE_ATTRS[prim_type]
+                                          for prim_type in prim_types)
+        handle.column_value_converters = tuple(
+            self.value_converter.get_column_converter(prim_type)
+            for prim_type in prim_types)
       handle.is_closed = False
       return handle
     finally:
@@ -811,83 +1108,164 @@ class ImpalaHS2Client(ImpalaClient):
     # massage it into the expected string representation. C++ and Java code
     # treats the low and high half as two 64-bit little-endian integers and
     # as a result prints the hex representation in the reverse order to how
-    # bytes are laid out in guid.
-    low_bytes_reversed = id_bytes[7::-1]
-    high_bytes_reversed = id_bytes[16:7:-1]
-
-    if sys.version_info.major < 3:
-      low_hex = low_bytes_reversed.encode('hex_codec')
-      high_hex = high_bytes_reversed.encode('hex_codec')
-    else:
-      low_hex = low_bytes_reversed.hex()
-      high_hex = high_bytes_reversed.hex()
-
-    return "{low}:{high}".format(low=low_hex, high=high_hex)
-
-  def fetch(self, query_handle):
+    # bytes are laid out in guid. Unpacking the two integers directly produces the
+    # same string without copying and hex-encoding reversed slices.
+    return "%016x:%016x" % struct.unpack_from("<QQ", id_bytes)
+
+  def fetch(self, query_handle, prefetch_next_batch=False):
+    # The FetchResults RPC for the next batch that runs in the background, if any.
+    next_fetch = None
+    # Traced RPCs are printed as they run. A background fetch would print its trace while
+    # the caller prints the rows of the previous batch, so the two would interleave.
+    prefetch_next_batch = (prefetch_next_batch and self.prefetch_next_batch
+                           and not self.rpc_stdout and self.rpc_file is None)
     try:
       self._set_current_query_handle(query_handle)
       assert query_handle.hasResultSet
-      prim_types = [column.typeDesc.types[0].primitiveEntry.type
-                    for column in query_handle.schema.columns]
-      column_value_getters = [HS2_VALUE_GETTERS[prim_type]
-                          for prim_type in prim_types]
-      column_value_converters = [self.value_converter.get_converter(prim_type)
-                          for prim_type in prim_types]
+      column_value_attrs = query_handle.column_value_attrs
+      column_value_converters = query_handle.column_value_converters
+
+      def FetchResults(req):
+        # A fetch that ran in the background is only waited for here, so that
+        # _do_hs2_rpc() handles and logs its errors on the caller's thread.
+        if next_fetch is not None:
+          return next_fetch.result()
+        return self.imp_service.FetchResults(req)
+      # The same request fetches every batch of the query. The first batch is kept small
+      # so that the first rows are displayed quickly, e.g. for queries with a LIMIT.
+      req = TFetchResultsReq(query_handle,
+                             TFetchOrientation.FETCH_NEXT,
+                             min(self.fetch_size, self.INITIAL_FETCH_SIZE))
+      is_first_batch = True
       while True:
-        def FetchResults(req):
-          return self.imp_service.FetchResults(req)
         # FetchResults rpc is not idempotent unless the client and server communicate and
         # results are kept around for retry to be successful.
-        req = TFetchResultsReq(query_handle,
-                               TFetchOrientation.FETCH_NEXT,
-                               self.fetch_size)
-        resp = self._do_hs2_rpc(FetchResults, req)
+        try:
+          resp = self._do_hs2_rpc(FetchResults, req)
+        finally:
+          next_fetch = None
         self._check_hs2_rpc_status(resp.status)
+        last_resp = resp
+        # The first batch is handed out as soon as it arrives.
+        if not is_first_batch:
+          last_resp = self._coalesce_small_fetches(FetchResults, req, resp,
+                                                   column_value_attrs)
+        is_first_batch = False
+        has_more_rows = self._hasMoreRows(last_resp, column_value_attrs)
+        if has_more_rows:
+          req.maxRows = min(self.fetch_size, req.maxRows * 2)
+        # The caller doesn't issue RPCs while it processes a batch, so the next fetch
+        # can use the connection in the meantime.
+        if has_more_rows and prefetch_next_batch:
+          # The http transport sends the request id, so the background RPC needs its own.
+          self._set_new_request_id()
+          next_fetch = BackgroundCall(self.imp_service.FetchResults, req)
 
         # Transpose the columns into a row-based format for more convenient processing
         # for the display code. This is somewhat inefficient, but performance is
         # comparable to the old Beeswax code.
-        yield self._transpose(column_value_getters, column_value_converters,
+        yield self._transpose(column_value_attrs, column_value_converters,
                               resp.results.columns)
-        if not self._hasMoreRows(resp, column_value_getters):
+        if not has_more_rows:
           return
     finally:
+      # If the caller stopped early, the connection must be idle before it is used again.
+      if next_fetch is not None:
+        next_fetch.wait()
       self._clear_current_query_handle()
 
-  def _hasMoreRows(self, resp, column_value_getters):
+  def _coalesce_small_fetches(self, fetch_rpc, req, resp, column_value_attrs):
+    """If 'resp' holds far fewer rows than 'req' asked for, e.g. because result spooling
+    is disabled and the server returns a single row batch at a time, issue up to
+    self.max_coalesced_fetches follow-up fetch RPCs with 'req' and append their rows to
+    'resp'. This cuts down the number of batches handed to the display code. No
+    follow-up fetch is issued once MAX_COALESCE_TIME_S passed since 'resp' arrived.
+    Returns the last response received, which determines whether more rows are
+    available."""
+    deadline = perf_counter() + self.MAX_COALESCE_TIME_S
+    last_resp = resp
+    num_fetches = 0
+    while (num_fetches < self.max_coalesced_fetches
+           and self._num_rows(resp, column_value_attrs) < req.maxRows // 4
+           and self._hasMoreRows(last_resp, column_value_attrs)
+           and perf_counter() < deadline):
+      last_resp = self._do_hs2_rpc(fetch_rpc, req)
+      self._check_hs2_rpc_status(last_resp.status)
+      self._append_columns(column_value_attrs, resp.results.columns,
+                           last_resp.results.columns)
+      num_fetches += 1
+    return last_resp
+
+  def _append_columns(self, column_value_attrs, columns, more_columns):
+    """Appends the values and nulls of the TColumns in 'more_columns' to the
+    corresponding TColumns in 'columns'."""
+    for attr, col, more_col in zip(column_value_attrs, columns, more_columns):
+      tcol, more_tcol = getattr(col, attr), getattr(more_col, attr)
+      if self._has_nulls(tcol) or self._has_nulls(more_tcol):
+        is_null = self._get_nulls_bitarray(tcol)
+        is_null.extend(self._get_nulls_bitarray(more_tcol))
+        tcol.nulls = is_null.tobytes()
+      else:
+        # An empty bitset means that none of the values is NULL.
+        tcol.nulls = b''
+      tcol.values.extend(more_tcol.values)
+
+  def _has_nulls(self, tcol):
+    """Returns whether any bit of the null bitset of 'tcol' is set. Most columns have no
+    NULLs at all, which a C-level scan of the bitset's bytes detects without building a
+    bitarray."""
+    return bool(tcol.nulls.strip(b'\x00'))
+
+  def _get_nulls_bitarray(self, tcol):
+    """Returns the null bitset of 'tcol' with exactly one bit per value."""
+    is_null = _get_bitarray_class()(endian='little')
+    is_null.frombytes(tcol.nulls)
+    num_values = len(tcol.values)
+    if len(is_null) > num_values:
+      del is_null[num_values:]
+    elif len(is_null) < num_values:
+      is_null.extend([False] * (num_values - len(is_null)))
+    return is_null
+
+  def _num_rows(self, resp, column_value_attrs):
+    """Returns the number of rows in the TFetchResultsResp 'resp'."""
+    return len(getattr(resp.results.columns[0], column_value_attrs[0]).values)
+
+  def _hasMoreRows(self, resp, column_value_attrs):
     return resp.hasMoreRows
 
-  def _transpose(self, column_value_getters, column_value_converters, columns):
-    """Transpose the columns from a TFetchResultsResp into the row format returned
-    by fetch() with all the values converted into their string representations for
-    display. Uses the getters and convertes provided in column_value_getters[i] and
-    column_value_converters[i] for column i."""
-    tcols = [column_value_getters[i](col) for i, col in enumerate(columns)]
-    num_rows = len(tcols[0].values)
-    # Preallocate rows for efficiency.
-    rows = [[None] * len(tcols) for i in xrange(num_rows)]
-    for col_idx, tcol in enumerate(tcols):
-      is_null = bitarray(endian='little')
-      is_null.frombytes(tcol.nulls)
-      stringifier = column_value_converters[col_idx]
+  def _transpose(self, column_value_attrs, column_value_converters, columns):
+    """Returns the columns from a TFetchResultsResp as a ColumnBatch, with all the
+    values converted into their string representations for display. Uses the TColumn
+    field name and the column converter (see HS2ValueConverter.get_column_converter())
+    provided in column_value_attrs[i] and column_value_converters[i] for column i."""
+    bitarray = _get_bitarray_class()
+    tcols = [getattr(col, attr) for attr, col in zip(column_value_attrs, columns)]
+    # Build each display column in a single pass. This keeps the per-cell iteration
+    # inside C-implemented builtins instead of indexing into every row from Python.
+    null_bit = bitarray('1')
+    display_cols = []
+    for tcol, column_converter in zip(tcols, column_value_converters):
       # Skip stringification if not needed. This makes large extracts of tpch.orders
-      # ~8% faster according to benchmarks.
-      if stringifier is None:
-        bitset_len = min(len(is_null), len(rows))
-        for current_row in xrange(bitset_len):
-          rows[current_row][col_idx] = 'NULL' if is_null[current_row] \
-              else tcol.values[current_row]
-        for current_row in xrange(bitset_len, len(rows)):
-          rows[current_row][col_idx] = tcol.values[current_row]
+      # ~8% faster according to benchmarks. Converting the placeholder values that HS2
+      # sends for NULLs is harmless and avoids a per-cell NULL check.
+      if column_converter is None:
+        display_col = list(tcol.values)
       else:
-        bitset_len = min(len(is_null), len(rows))
-        for current_row in xrange(bitset_len):
-          rows[current_row][col_idx] = 'NULL' if is_null[current_row] \
-              else stringifier(tcol.values[current_row])
-        for current_row in xrange(bitset_len, len(rows)):
-          rows[current_row][col_idx] = stringifier(tcol.values[current_row])
-    return rows
+        display_col = column_converter(tcol.values)
+      if self._has_nulls(tcol):
+        # Decode the null bitset in bulk and only visit the NULL positions, which
+        # bitarray finds with a C-level scan.
+        is_null = bitarray(endian='little')
+        is_null.frombytes(tcol.nulls)
+        num_rows = len(display_col)
+        for row_idx in is_null.itersearch(null_bit):
+          if row_idx >= num_rows:
+            break
+          display_col[row_idx] = 'NULL'
+      display_cols.append(display_col)
+    num_rows = len(display_cols[0]) if display_cols else 0
+    return ColumnBatch(display_cols, num_rows)
 
   def close_dml(self, last_query_handle):
     try:
@@ -947,7 +1325,8 @@ class ImpalaHS2Client(ImpalaClient):
       def GetOperationStatus(req):
         return self.imp_service.GetOperationStatus(req)
       # GetOperationStatus rpc is idempotent and so safe to retry.
-      req = TGetOperationStatusReq(last_query_handle)
+      req = self._get_operation_status_req
+      req.operationHandle = last_query_handle
       resp = self._do_hs2_rpc(GetOperationStatus, req, retry_on_error=True)
       self._check_hs2_rpc_status(resp.status)
       return resp.operationState
@@ -980,9 +1359,9 @@ class ImpalaHS2Client(ImpalaClient):
       def GetExecSummary(req):
         return self.imp_service.GetExecSummary(req)
       # GetExecSummary rpc is idempotent and so safe to retry.
-      req = TGetExecSummaryReq(last_query_handle,
-                           self.session_handle,
-                           include_query_attempts=True)
+      req = self._get_exec_summary_req
+      req.operationHandle = last_query_handle
+      req.sessionHandle = self.session_handle
       resp = self._do_hs2_rpc(GetExecSummary, req, retry_on_error=True)
       self._check_hs2_rpc_status(resp.status)
       failed_summary = None
@@ -995,7 +1374,7 @@ class ImpalaHS2Client(ImpalaClient):
   def get_column_names(self, last_query_handle):
     # The handle has the schema embedded in it.
     assert last_query_handle.hasResultSet
-    return [column.columnName for column in last_query_handle.schema.columns]
+    return list(map(get_column_name, last_query_handle.schema.columns))
 
   def expect_result_metadata(self, query_str, query_handle):
     """ Given a query string, return True if impalad expects result metadata."""
@@ -1019,16 +1398,23 @@ class ImpalaHS2Client(ImpalaClient):
 
       log = utf8_decode_if_needed(resp.log)
 
-      # Strip progress message out of HS2 log.
-      log = HS2_LOG_PROGRESS_REGEX.sub("", log)
-      if log and log.strip():
+      # Strip progress message out of HS2 log. The substring check is much cheaper than
+      # a regex scan and skips the scan for logs without a progress line.
+      if HS2_LOG_PROGRESS_MARKER in log:
+        log = HS2_LOG_PROGRESS_REGEX.sub("", log)
+      # isspace() stops at the first non-whitespace character and doesn't copy the log,
+      # unlike strip().
+      if log and not log.isspace():
         log = self._append_retried_query_link(log)
-        type_str = "WARNINGS" if warn is True else "ERROR"
-        return "%s: %s" % (type_str, log)
+        return WARN_OR_ERROR_LOG_PREFIX[warn] + log
       return ""
     finally:
       self._clear_current_query_handle()
 
+  def _set_new_request_id(self):
+    self._request_num += 1
+    self._current_request_id = self._base_request_id + str(self._request_num)
+
   def _do_hs2_rpc(self, rpc, rpc_input,
                   suppress_error_on_cancel=True, retry_on_error=False):
     """Executes the provided 'rpc' callable and translates any exceptions in the
@@ -1043,8 +1429,7 @@ class ImpalaHS2Client(ImpalaClient):
     number of tries is determined by 'self.max_tries'. Retries, if enabled, are attempted
     for all exceptions other than TApplicationException."""
 
-    self._request_num += 1
-    self._current_request_id = "{0}-{1}".format(self._base_request_id, self._request_num)
+    self._set_new_request_id()
     self._check_connected()
     num_tries = 1
     max_tries = num_tries
@@ -1053,17 +1438,13 @@ class ImpalaHS2Client(ImpalaClient):
     while num_tries <= max_tries:
       start_time = self._print_rpc_start(rpc, rpc_input, num_tries)
       raise_error = (num_tries == max_tries)
-      # Generate a retry message, only if retries and supported.
-      will_retry = False
+      will_retry = num_tries < max_tries
       retry_secs = None
-      if retry_on_error and self.max_tries > 1:
-        retry_msg = 'Num remaining tries: {0}'.format(max_tries - num_tries)
-        if num_tries < max_tries:
-          will_retry = True
-      else:
-        retry_msg = ''
       try:
+        # Cleared first so that a failed RPC makes is_connected() check the connection.
+        self._last_successful_rpc_time = None
         rpc_output = rpc(rpc_input)
+        self._last_successful_rpc_time = perf_counter()
         self._print_rpc_end(rpc, rpc_output, start_time, "SUCCESS")
         return rpc_output
       except TTransportException as e:
@@ -1072,7 +1453,8 @@ class ImpalaHS2Client(ImpalaClient):
           e = e.inner
         # issue with the connection with the impalad
         log_exception_with_timestamp(e, "Exception",
-           "type={0} in {1}. {2}".format(type(e), rpc.__name__, retry_msg))
+           "type={0} in {1}. {2}".format(type(e), rpc.__name__,
+                                         self._get_retry_msg(num_tries, max_tries)))
         self._print_rpc_end(rpc, None, start_time, "Error - TTransportException")
         if raise_error:
           if isinstance(e, TTransportException):
@@ -1088,6 +1470,7 @@ class ImpalaHS2Client(ImpalaClient):
         raise RPCException("Application Exception : {0}".format(t),
           RPC_EXCEPTION_TAPPLICATION)
       except HttpError as h:
+        retry_msg = self._get_retry_msg(num_tries, max_tries)
         if will_retry:
           retry_after = h.http_headers.get('Retry-After', None)
           if retry_after:
@@ -1107,7 +1490,7 @@ class ImpalaHS2Client(ImpalaClient):
           raise
       except Exception as e:
         log_exception_with_timestamp(e, "Exception", "type={0} in {1}. {2}"
-          .format(type(e), rpc.__name__, retry_msg))
+          .format(type(e), rpc.__name__, self._get_retry_msg(num_tries, max_tries)))
         self._print_rpc_end(rpc, None, start_time, "Error")
         if raise_error:
           raise
@@ -1154,11 +1537,12 @@ class ImpalaHS2Client(ImpalaClient):
     """Prints out a nicely formatted detailed breakdown of the request to
     a rpc call.  Handles both the 'rpc_stdout' and 'rpc_file' command line arguments."""
     if self.rpc_stdout or self.rpc_file is not None:
-      start_time = datetime.now()
+      # The wall clock time is only printed, the duration is measured with perf_counter.
+      start_timestamp = datetime.now()
 
       def print_start_to_file(fh):
         self._print_line_separator(fh)
-        fh.write("[{0}] RPC CALL STARTED:\n".format(start_time))
+        fh.write("[{0}] RPC CALL STARTED:\n".format(start_timestamp))
         fh.write("OPERATION: {0}\nDETAILS:\n".format(rpc_func.__name__))
         fh.write("  * Impala Session Id: {0}\n".format(self.get_session_id()))
         fh.write("  * Impala Query Id:   {0}\n"
@@ -1167,42 +1551,52 @@ class ImpalaHS2Client(ImpalaClient):
         fh.write("\nRPC REQUEST:\n")
         self.thrift_printer.print_obj(rpc_input, fh)
         self._print_line_separator(fh)
+        # Flush each record so that the file can be followed while the shell runs.
+        fh.flush()
 
       if self.rpc_stdout:
         print_start_to_file(sys.stdout)
 
       if self.rpc_file:
-        with open(self.rpc_file, "a") as f:
-          print_start_to_file(f)
+        print_start_to_file(self._get_rpc_file_handle())
 
-      return start_time
+      # Read the clock last so that the time spent printing isn't counted.
+      return perf_counter()
 
     return None
 
   def _print_rpc_end(self, rpc_func, rpc_output, start_time, result):
     """Prints out a nicely formatted detailed breakdown of the response from
-    a rpc call.  Handles both the 'rpc_stdout' and 'rpc_file' command line arguments."""
+    a rpc call.  Handles both the 'rpc_stdout' and 'rpc_file' command line arguments.
+    'start_time' is the perf_counter() value returned by _print_rpc_start()."""
     if self.rpc_stdout or self.rpc_file is not None:
+      duration_ms = (perf_counter() - start_time) * 1000
       end_time = datetime.now()
-      duration = end_time - start_time
 
       def print_end_to_file(fh):
         self._print_line_separator(fh)
         fh.write("[{0}] RPC CALL FINISHED:\n".format(end_time))
         fh.write("OPERATION: {0}\nDETAILS:\n".format(rpc_func.__name__))
-        fh.write("  * Time:   {0}ms\n".format(duration.total_seconds() * 1000))
+        fh.write("  * Time:   {0}ms\n".format(duration_ms))
         fh.write("  * Result: {0}\n".format(result))
         if rpc_output is not None:
           fh.write("\nRPC RESPONSE:\n")
           self.thrift_printer.print_obj(rpc_output, fh)
         self._print_line_separator(fh)
+        fh.flush()
 
       if self.rpc_stdout:
         print_end_to_file(sys.stdout)
 
       if self.rpc_file:
-        with open(self.rpc_file, "a") as f:
-          print_end_to_file(f)
+        print_end_to_file(self._get_rpc_file_handle())
+
+  def _get_rpc_file_handle(self):
+    """Returns the handle of self.rpc_file, opening the file for appending on first use.
+    Keeping it open saves an open() and a close() for every RPC start and end record."""
+    if self._rpc_file_handle is None:
+      self._rpc_file_handle = open(self.rpc_file, "a")
+    return self._rpc_file_handle
 
 
 class RpcStatus:
@@ -1238,6 +1632,11 @@ class StrictHS2Client(ImpalaHS2Client):
     finally:
       self._clear_current_query_handle()
 
+  def close_query_and_connection(self, last_query_handle):
+    # The pipelined close in ImpalaHS2Client uses the Impala-specific
+    # CloseImpalaOperation RPC, so close the query and the connection one by one.
+    return ImpalaClient.close_query_and_connection(self, last_query_handle)
+
   def _ping_impala_service(self):
     return ("N/A", "N/A")
 
@@ -1253,9 +1652,8 @@ class StrictHS2Client(ImpalaHS2Client):
   def _populate_query_options(self):
     return
 
-  def _hasMoreRows(self, resp, column_value_getters):
-    tcol = column_value_getters[0](resp.results.columns[0])
-    return len(tcol.values)
+  def _hasMoreRows(self, resp, column_value_attrs):
+    return self._num_rows(resp, column_value_attrs)
 
 
 class ImpalaBeeswaxClient(ImpalaClient):
@@ -1272,11 +1670,11 @@ class ImpalaBeeswaxClient(ImpalaClient):
     return ImpalaService.Client(protocol)
 
   def _options_to_string_list(self, set_query_options):
-    if sys.version_info.major < 3:
-      key_value_pairs = set_query_options.iteritems()
-    else:
-      key_value_pairs = set_query_options.items()
-    return [utf8_encode_if_needed("%s=%s" % (k, v)) for (k, v) in key_value_pairs]
+    if IS_PY2:
+      return [utf8_encode_if_needed("%s=%s" % (k, v))
+              for (k, v) in set_query_options.iteritems()]
+    # The options don't need to be encoded in Python 3.
+    return ["%s=%s" % (k, v) for (k, v) in set_query_options.items()]
 
   def _open_session(self):
     # Beeswax doesn't have a "session" concept independent of connections, so
@@ -1297,12 +1695,13 @@ class ImpalaBeeswaxClient(ImpalaClient):
       raise RPCException("Unable to retrieve default query options")
 
     for option in options:
-      self.default_query_options[option.key.upper()] = option.value
+      name = option.key.upper()
+      self.default_query_options[name] = option.value
       # If connected to an Impala that predates IMPALA-2181 then the received options
       # wouldn't contain a level attribute. In this case the query_option_levels
       # map is left empty.
       if option.level is not None:
-        self.query_option_levels[option.key.upper()] = option.level
+        self.query_option_levels[name] = option.level
 
   def close_connection(self):
     # Beeswax sessions are scoped to the connection, so we only need to close transport.
@@ -1336,7 +1735,7 @@ class ImpalaBeeswaxClient(ImpalaClient):
     ImpalaClient method calls for the query."""
     query = self._create_query_req(query_str, set_query_options)
     self.is_query_cancelled = False
-    handle, rpc_status = self._do_beeswax_rpc(lambda: self.imp_service.query(query))
+    handle, rpc_status = self._do_beeswax_rpc(self.imp_service.query, (query,))
     if rpc_status != RpcStatus.OK:
       raise RPCException("Error executing the query")
     handle.is_closed = False
@@ -1347,16 +1746,20 @@ class ImpalaBeeswaxClient(ImpalaClient):
 
   def get_query_state(self, last_query_handle):
     state, rpc_status = self._do_beeswax_rpc(
-        lambda: self.imp_service.get_state(last_query_handle))
+        self.imp_service.get_state, (last_query_handle,))
     if rpc_status != RpcStatus.OK:
       return self.ERROR_STATE
     return state
 
-  def fetch(self, query_handle):
+  def fetch(self, query_handle, prefetch_next_batch=False):
+    fetch_args = (query_handle, False, self.fetch_size)
     while True:
-      result, rpc_status = self._do_beeswax_rpc(
-         lambda: self.imp_service.fetch(query_handle, False,
-                                        self.fetch_size))
+      # Once the shell cancelled the query, the server fails every fetch with a
+      # BeeswaxException, which _do_beeswax_rpc() turns into this exception. Skip the
+      # round trip and raise it directly.
+      if self.is_query_cancelled:
+        raise QueryCancelledByShellException()
+      result, rpc_status = self._do_beeswax_rpc(self.imp_service.fetch, fetch_args)
       if rpc_status != RpcStatus.OK:
         raise RPCException()
 
@@ -1372,7 +1775,7 @@ class ImpalaBeeswaxClient(ImpalaClient):
 
   def close_dml(self, last_query_handle):
     dml_result, rpc_status = self._do_beeswax_rpc(
-        lambda: self.imp_service.CloseInsert(last_query_handle))
+        self.imp_service.CloseInsert, (last_query_handle,))
     if rpc_status != RpcStatus.OK:
       raise RPCException()
     last_query_handle.is_closed = True
@@ -1383,7 +1786,7 @@ class ImpalaBeeswaxClient(ImpalaClient):
     if last_query_handle.is_closed:
       return True
     _, rpc_status = self._do_beeswax_rpc(
-        lambda: self.imp_service.close(last_query_handle))
+        self.imp_service.close, (last_query_handle,))
     last_query_handle.is_closed = True
     return rpc_status == RpcStatus.OK
 
@@ -1392,57 +1795,93 @@ class ImpalaBeeswaxClient(ImpalaClient):
     # co-ordinator, so we don't need to wait.
     if last_query_handle.is_closed:
       return True
-    _, rpc_status = self._do_beeswax_rpc(
-        lambda: self.imp_service.Cancel(last_query_handle), False)
+    _, rpc_status = self._do_beeswax_status_rpc(
+        self.imp_service.Cancel, (last_query_handle,), False)
     return rpc_status == RpcStatus.OK
 
   def get_runtime_profile(self, last_query_handle):
     profile, rpc_status = self._do_beeswax_rpc(
-        lambda: self.imp_service.GetRuntimeProfile(last_query_handle))
+        self.imp_service.GetRuntimeProfile, (last_query_handle,))
     if rpc_status == RpcStatus.OK and profile:
       return profile, None
     return None, None
 
   def get_summary(self, last_query_handle):
     summary, rpc_status = self._do_beeswax_rpc(
-      lambda: self.imp_service.GetExecSummary(last_query_handle))
+      self.imp_service.GetExecSummary, (last_query_handle,))
     if rpc_status == RpcStatus.OK and summary:
       return summary, None
     return None, None
 
   def get_column_names(self, last_query_handle):
-    # Note: the code originally ignored the RPC status. don't mess with it.
-    metadata, _ = self._do_beeswax_rpc(
-        lambda: self.imp_service.get_results_metadata(last_query_handle))
-    if metadata is not None:
-      return [fs.name for fs in metadata.schema.fieldSchemas]
+    # The schema of a query doesn't change, so it is attached to the handle the first
+    # time it is fetched, like ImpalaHS2Client does in execute_query().
+    schema = getattr(last_query_handle, 'schema', None)
+    if schema is None:
+      # Note: the code originally ignored the RPC status. don't mess with it.
+      metadata, _ = self._do_beeswax_rpc(
+          self.imp_service.get_results_metadata, (last_query_handle,))
+      if metadata is None:
+        return None
+      schema = last_query_handle.schema = metadata.schema
+    return list(map(get_field_schema_name, schema.fieldSchemas))
 
   def expect_result_metadata(self, query_str, query_handle):
     # Beeswax doesn't provide us this metadata; try to guess whether to expect it based
     # on the query string.
-    query_substr = query_str[:3].lower()
-    excluded_query_types = ['use']
-    if any(map(query_substr.startswith, excluded_query_types)):
-      return False
-    return True
+    return query_str[:3].lower() not in BEESWAX_NO_METADATA_QUERY_TYPES
+
+  def get_warning_log_and_close_query(self, last_query_handle):
+    if last_query_handle is None or last_query_handle.is_closed:
+      return super(ImpalaBeeswaxClient, self).get_warning_log_and_close_query(
+          last_query_handle)
+    # Beeswax always uses the binary transport, so both requests are written to the
+    # socket before either response is read, which saves a round trip. The server
+    # handles the requests of a connection in order, so the responses arrive in the
+    # same order.
+
+    def send_get_log_and_close():
+      self.imp_service.send_get_log(last_query_handle.log_context)
+      self.imp_service.send_close(last_query_handle)
+    self._do_beeswax_rpc(send_get_log_and_close)
+    get_log_failed = True
+    try:
+      log, rpc_status = self._do_beeswax_rpc(self.imp_service.recv_get_log)
+      log_time = time.time()
+      get_log_failed = False
+    finally:
+      # Always read the close response, so that it isn't mistaken for the response to
+      # the next RPC on this connection. If get_log failed, its error is the one that is
+      # raised, since a failure to read the close response would be a consequence.
+      try:
+        self._do_beeswax_rpc(self.imp_service.recv_close)
+      except Exception:
+        if not get_log_failed:
+          raise
+      last_query_handle.is_closed = True
+    return self._format_warn_or_error_log(log, rpc_status, True), log_time
 
   def _get_warn_or_error_log(self, last_query_handle, warn):
     if last_query_handle is None:
       return "Query could not be executed"
     log, rpc_status = self._do_beeswax_rpc(
-        lambda: self.imp_service.get_log(last_query_handle.log_context))
+        self.imp_service.get_log, (last_query_handle.log_context,))
+    return self._format_warn_or_error_log(log, rpc_status, warn)
+
+  def _format_warn_or_error_log(self, log, rpc_status, warn):
+    """Formats the result of a get_log() RPC for _get_warn_or_error_log()."""
     if rpc_status != RpcStatus.OK:
-      type_str = "warn" if warn is True else "error"
-      return "Failed to get %s log: %s" % (type_str, rpc_status)
-    if log and log.strip():
+      return FAILED_WARN_OR_ERROR_LOG_FORMAT[warn] % rpc_status
+    if log and not log.isspace():
       log = utf8_decode_if_needed(log)
       log = self._append_retried_query_link(log)
-      type_str = "WARNINGS" if warn is True else "ERROR"
-      return "%s: %s" % (type_str, log)
+      return WARN_OR_ERROR_LOG_PREFIX[warn] + log
     return ""
 
-  def _do_beeswax_rpc(self, rpc, suppress_error_on_cancel=True):
-    """Executes the provided 'rpc' callable. Raises exceptions for most errors,
+  def _do_beeswax_rpc(self, rpc, args=(), suppress_error_on_cancel=True):
+    """Executes the provided 'rpc' callable, usually a method of self.imp_service, with
+    the arguments in the tuple 'args'. Passing the bound method and its arguments avoids
+    creating a closure for every RPC. Raises exceptions for most errors,
     including:
     * DisconnectedException if the client cannot communicate with the server.
     * QueryCancelledByShellException if 'suppress_error_on_cancel' is true, the RPC
@@ -1450,20 +1889,15 @@ class ImpalaBeeswaxClient(ImpalaClient):
     * RPCException if the operation fails with an error status
     * QueryStateException if the query is not registered on the server.
     * MissingThriftMethodException if the thrift method is not implemented on the server.
-    Returns RPCStatus.OK on success or RPCStatus.ERROR for any other errors."""
+    Returns the result of the RPC and RPCStatus.OK on success. Use
+    _do_beeswax_status_rpc() for RPCs that return a TStatus."""
     self._check_connected()
     try:
-      ret = rpc()
-      status = RpcStatus.OK
-      # TODO: In the future more advanced error detection/handling can be done based on
-      # the TStatus return value. For now, just print any error(s) that were encountered
-      # and validate the result of the operation was a success.
-      if ret is not None and isinstance(ret, TStatus):
-        if ret.status_code != TErrorCode.OK:
-          if ret.error_msgs:
-            raise RPCException('RPC Error: %s' % '\n'.join(ret.error_msgs))
-          status = RpcStatus.ERROR
-      return ret, status
+      # Cleared first so that a failed RPC makes is_connected() check the connection.
+      self._last_successful_rpc_time = None
+      ret = rpc(*args)
+      self._last_successful_rpc_time = perf_counter()
+      return ret, RpcStatus.OK
     except BeeswaxService.QueryNotFoundException:
       if suppress_error_on_cancel and self.is_query_cancelled:
         raise QueryCancelledByShellException()
@@ -1474,7 +1908,7 @@ class ImpalaBeeswaxClient(ImpalaClient):
       # Suppress the errors from cancelling a query that is in fetch state
       if suppress_error_on_cancel and self.is_query_cancelled:
         raise QueryCancelledByShellException()
-      raise RPCException(utf8_encode_if_needed("ERROR: %s") % b.message)
+      raise RPCException(BEESWAX_EXCEPTION_FORMAT % b.message)
     except TTransportException as e:
       # Unwrap socket.error so we can handle it directly.
       if isinstance(e.inner, socket.error):
@@ -1517,32 +1951,47 @@ class ImpalaBeeswaxClient(ImpalaClient):
       # happens to be the primary command loop in impala_shell.py). This in turn
       # has the result of disconnecting the shell in the case of, say, even simple
       # typos in database or table names.
+      #
+      # The exceptions are recognized by their class name, which is the same in both
+      # module layouts. This avoids converting every unknown exception to a string.
       if suppress_error_on_cancel and self.is_query_cancelled:
         raise QueryCancelledByShellException()
       else:
-        if "BeeswaxException" in str(e):
+        exception_name = type(e).__name__
+        if exception_name == "BeeswaxException":
           raise RPCException("ERROR: %s" % e.message)
-        if "QueryNotFoundException" in str(e):
+        if exception_name == "QueryNotFoundException":
           raise QueryStateException('Error: Stale query handle')
-        # Print more details for other kinds of exceptions
+        # Print more details for other kinds of exceptions. The stack trace is only
+        # printed in verbose mode; formatting it reads the source of every frame.
         log_exception_with_timestamp(e, "Exception", "type={0}".format(type(e)))
-        traceback.print_exc()
+        if self.verbose:
+          traceback.print_exc()
         raise Exception("Encountered unknown exception")
 
+  def _do_beeswax_status_rpc(self, rpc, args=(), suppress_error_on_cancel=True):
+    """Executes the provided 'rpc' callable, which returns a TStatus, like
+    _do_beeswax_rpc(). Also raises RPCException if the returned status has error
+    messages. Returns RPCStatus.OK on success or RPCStatus.ERROR for any other errors."""
+    ret, status = self._do_beeswax_rpc(rpc, args, suppress_error_on_cancel)
+    # TODO: In the future more advanced error detection/handling can be done based on
+    # the TStatus return value. For now, just print any error(s) that were encountered
+    # and validate the result of the operation was a success.
+    if ret is not None and ret.status_code != TErrorCode.OK:
+      if ret.error_msgs:
+        raise RPCException('RPC Error: %s' % '\n'.join(ret.error_msgs))
+      status = RpcStatus.ERROR
+    return ret, status
+
 
 def log_exception_with_timestamp(e, type="Exception", msg="", stderr_flag=True):
   # method log_exception_with_timestamp prints timestamp with exception trace
   # and accepts custom message before timestamp. stderr_flag controls print statement
   # to be logged in stderr, by default it is true.
-  if (stderr_flag):
-      print("%s [%s] %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), type,
-      msg), e, file=sys.stderr)
-  else:
-      print("%s [%s] %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), type,
-       msg), e)
+  print("%s [%s] %s" % (_format_log_timestamp(), type, msg), e,
+      file=sys.stderr if stderr_flag else sys.stdout)
 
 
 def log_timestamp(type="Exception", msg=""):
   # method log_timestamp prints timestamp with custom message
-  print("%s [%s] %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), type, msg),
-      file=sys.stderr)
+  print("%s [%s] %s" % (_format_log_timestamp(), type, msg), file=sys.stderr)
@@ -741,9 +741,10 @@ class ImpalaShell(cmd.Cmd, object):
         new_imp_client.connect()
         try:
           new_imp_client.cancel_query(self.last_query_handle)
-          new_imp_client.close_query(self.last_query_handle)
-        finally:
+        except Exception:
           new_imp_client.close_connection()
+          raise
+        new_imp_client.close_query_and_connection(self.last_query_handle)
         break
       except Exception as e:
         # Suppress harmless errors.
@@ -1492,6 +1493,7 @@ class ImpalaShell(cmd.Cmd, object):
         # retrieve the error log
         warning_log = self.imp_client.get_warning_log(self.last_query_handle)
         dml_result = self.imp_client.close_dml(self.last_query_handle)
+        end_time = time.time()
       else:
         # impalad does not support the fetching of metadata for certain types of queries.
         if not self.imp_client.expect_result_metadata(query_str, self.last_query_handle):
@@ -1501,26 +1503,34 @@ class ImpalaShell(cmd.Cmd, object):
           return CmdStatus.SUCCESS
 
         self._format_outputstream()
-        # fetch returns a generator
-        rows_fetched = self.imp_client.fetch(self.last_query_handle)
+        # fetch returns a generator. No RPCs are issued while the rows are written, so
+        # the client can fetch the next batch in the meantime.
+        rows_fetched = self.imp_client.fetch(self.last_query_handle,
+                                             prefetch_next_batch=True)
         num_rows = 0
 
-        for rows in rows_fetched:
-          # IMPALA-4418: Break out of the loop to prevent printing an unnecessary
-          # empty line.
-          if len(rows) == 0:
-            continue
-          self.output_stream.write(rows)
-          num_rows += len(rows)
-
-        # retrieve the error log
-        warning_log = self.imp_client.get_warning_log(self.last_query_handle)
+        try:
+          for rows in rows_fetched:
+            # IMPALA-4418: Break out of the loop to prevent printing an unnecessary
+            # empty line.
+            if len(rows) == 0:
+              continue
+            self.output_stream.write(rows)
+            num_rows += len(rows)
+        finally:
+          # The HS2 client may be fetching the next batch in the background. Closing
+          # the generator waits for that RPC, so that the connection is idle again.
+          rows_fetched.close()
 
         # Flush the row output. This is important so that the row output will not
         # come after the "Fetch X row(s)" message.
         self.output_stream.flush()
 
-      end_time = time.time()
+        # retrieve the error log. The query is closed at the same time, which lets the
+        # client combine the two RPCs. The elapsed time ends when the log arrives, so
+        # that it doesn't include closing the query.
+        warning_log, end_time = self.imp_client.get_warning_log_and_close_query(
+            self.last_query_handle)
 
       if warning_log:
         self._print_if_verbose(warning_log)
@@ -1533,8 +1543,6 @@ class ImpalaShell(cmd.Cmd, object):
         row_report = self._format_num_rows_report(time_elapsed, num_fetched_rows=num_rows)
       self._print_if_verbose(row_report)
 
-      if not is_dml:
-        self.imp_client.close_query(self.last_query_handle)
       if self.show_profiles:
         profile, retried_profile = self.imp_client.get_runtime_profile(
             self.last_query_handle)
@@ -339,7 +339,7 @@ def get_option_parser(defaults):
                     "enforce any http path for the incoming requests, deployments could "
                     "still put it behind a loadbalancer that can expect the traffic at a "
                     "certain path.")
-  parser.add_option("--fetch_size", type="int", dest="fetch_size", default=8192,
+  parser.add_option("--fetch_size", type="int", dest="fetch_size", default=10240,
                     help="The fetch size when fetching rows from the Impala coordinator. "
                     "The fetch size controls how many rows a single fetch RPC request "
                     "(RPC from the Impala shell to the Impala coordinator) reads at a "
@@ -347,10 +347,15 @@ def get_option_parser(defaults):
                     "('spool_query_results'=true). When result spooling is enabled "
                     "values over the batch_size are honored. When result spooling is "
                     "disabled, values over the batch_size have no affect. By default, "
-                    "the fetch_size is set to 8192 which is equivalent to 8 row "
+                    "the fetch_size is set to 10240 which is equivalent to 10 row "
                     "batches (assuming the default batch size). Note that if result "
-                    "spooling is disabled only a single row batch can be fetched at a "
-                    "time regardless of the specified fetch_size.")
+                    "spooling is disabled only a single row batch can be fetched per "
+                    "RPC regardless of the specified fetch_size; with the hs2 "
+                    "protocols the shell then issues a few follow-up RPCs to fill up "
+                    "small batches before displaying them. With the hs2 protocols the "
+                    "first fetch RPC of a query reads at most 1024 rows, and each "
+                    "following RPC reads up to twice as many, until the fetch_size is "
+                    "reached.")
   parser.add_option("--http_cookie_names", dest="http_cookie_names",
                     default="*",
                     help="A comma-separated list of HTTP cookie names that are supported "
@@ -26,6 +26,9 @@ class ValueConverter(object):
   def get_converter(value):
       pass
 
+  def get_column_converter(value):
+      pass
+
   def override_floating_point_converter(format_specification):
       pass
 
@@ -37,9 +40,28 @@ class HS2ValueConverter(ValueConverter):
           return str
       return lambda s: s.decode(errors='replace')
 
+  def __get_binary_column_converter(self):
+      if sys.version_info.major < 3:
+          return None
+
+      def convert(values):
+          # Decoding a large column with one call is much cheaper than decoding every
+          # value. The NUL separator also ends any truncated multi-byte sequence, so
+          # invalid bytes are replaced the same way as when decoding value by value.
+          # If a value contains a NUL byte itself, the parts don't line up with the
+          # values and they are decoded one by one.
+          if len(values) > 256:
+              decoded = b'\x00'.join(values).decode(errors='replace').split('\x00')
+              if len(decoded) == len(values):
+                  return decoded
+          return [value.decode(errors='replace') for value in values]
+      return convert
+
   def __init__(self):
       self.value_converters = {
-          TTypeId.BOOLEAN_TYPE: lambda b: 'true' if b else 'false',
+          # A bound dict lookup runs entirely in C when mapped over a column, unlike a
+          # lambda.
+          TTypeId.BOOLEAN_TYPE: {True: 'true', False: 'false'}.__getitem__,
           TTypeId.TINYINT_TYPE: str,
           TTypeId.SMALLINT_TYPE: str,
           TTypeId.INT_TYPE: str,
@@ -48,10 +70,27 @@ class HS2ValueConverter(ValueConverter):
           TTypeId.FLOAT_TYPE: str,
           TTypeId.DOUBLE_TYPE: str
       }
+      # Converters that convert a whole column, a list of values, at once. Types
+      # without an entry here are converted with their value converter.
+      self.column_converters = {}
+      binary_column_converter = self.__get_binary_column_converter()
+      if binary_column_converter is not None:
+          self.column_converters[TTypeId.BINARY_TYPE] = binary_column_converter
 
   def get_converter(self, value):
       return self.value_converters.get(value, None)
 
+  def get_column_converter(self, value):
+      """Returns a function that converts a list of values of type 'value' into a new
+      list of display strings, or None if the values don't need to be converted."""
+      column_converter = self.column_converters.get(value, None)
+      if column_converter is not None:
+          return column_converter
+      converter = self.get_converter(value)
+      if converter is None:
+          return None
+      return lambda values: list(map(converter, values))
+
   def override_floating_point_converter(self, format_specification):
       def convert(value):
           return ('{:%s}' % format_specification).format(value)
@@ -16,6 +16,7 @@
 # under the License.
 
 from __future__ import absolute_import, division, print_function
+import socket
 from time import sleep
 
 from builtins import round
@@ -74,6 +75,12 @@ class FaultInjectingHttpClient(ImpalaHttpClient, object):
   def disable_fault(self):
     self.fault_enabled = False
 
+  def drop_idle_connection(self):
+    """Shuts down the socket of the open, idle connection without closing the
+    connection. To the client this looks like the server closed the keep-alive
+    connection between two requests."""
+    self._ImpalaHttpClient__http.sock.shutdown(socket.SHUT_RDWR)
+
   def _check_code(self):
     if self.code >= 300:
       # Report any http response code that is not 1XX (informational response) or
@@ -418,8 +425,8 @@ class TestHS2FaultInjection(CustomClusterTestSuite):
 
   @pytest.mark.execute_serially
   def test_connection_drop(self):
-    """Tests connection drop between rpcs. Each rpc starts a new connection so dropping
-    connections between rpcs should have no effect"""
+    """Tests that the client reconnects when the connection is explicitly closed between
+    rpcs, so dropping connections between rpcs has no effect."""
     self.connect()
     self.transport.close()
     query_handle = self.custom_hs2_http_client.execute_query('select 1', {})
@@ -442,3 +449,23 @@ class TestHS2FaultInjection(CustomClusterTestSuite):
     self.transport.close()
     summary = self.custom_hs2_http_client.get_summary(query_handle)
     assert summary is not None
+
+  @pytest.mark.execute_serially
+  def test_idle_connection_closed_by_server(self, capsys):
+    """Tests that the client reconnects, without an rpc failing or being retried, when
+    the server closed the idle keep-alive connection between rpcs."""
+    self.connect()
+    query_handle = self.custom_hs2_http_client.execute_query('select 1', {})
+    self.transport.drop_idle_connection()
+    self.custom_hs2_http_client.wait_to_finish(query_handle)
+    self.transport.drop_idle_connection()
+    num_rows = 0
+    for rows in self.custom_hs2_http_client.fetch(query_handle):
+      num_rows += len(rows)
+    assert num_rows == 1
+    self.transport.drop_idle_connection()
+    self.close_query(query_handle)
+    self.transport.drop_idle_connection()
+    profile = self.custom_hs2_http_client.get_runtime_profile(query_handle)
+    assert profile is not None
+    assert "[Exception]" not in capsys.readouterr()[1]
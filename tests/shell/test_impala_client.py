@@ -0,0 +1,294 @@
+#!/usr/bin/env impala-python
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import absolute_import, division, print_function
+import socket
+import threading
+
+from bitarray import bitarray
+import pytest
+from thrift.transport.TTransport import TTransportException
+
+from impala_shell import impala_client
+from impala_shell.impala_client import ImpalaBeeswaxClient, ImpalaHS2Client
+from impala_shell.shell_exceptions import DisconnectedException
+from impala_thrift_gen.TCLIService.TCLIService import (
+    TBinaryColumn,
+    TColumn,
+    TFetchOrientation,
+    TFetchResultsReq,
+    TFetchResultsResp,
+    TI64Column,
+    TRowSet,
+    TStatus,
+    TStatusCode,
+    TTypeId,
+)
+from tests.common.base_test_suite import BaseTestSuite
+
+
+class FakeTSocket(object):
+  """Stand-in for thrift's TSocket, which exposes the connected socket as 'handle'."""
+  def __init__(self, handle):
+    self.handle = handle
+
+
+class FakeImpalaService(object):
+  """Counts the PingImpalaService RPCs."""
+  def __init__(self):
+    self.num_pings = 0
+
+  def PingImpalaService(self):
+    self.num_pings += 1
+
+    class Resp(object):
+      version = 'N/A'
+      webserver_address = 'N/A'
+    return Resp()
+
+  def get_state(self, handle):
+    raise TTransportException(message="connection reset")
+
+
+def make_fetch_resp(ids, null_ids=(), has_more_rows=True, nulls=None):
+  """Returns a TFetchResultsResp with a BIGINT column holding 'ids', NULL for the ids in
+  'null_ids', and a BINARY column holding the ids as bytes. 'nulls' overrides the null
+  bitset of the BIGINT column."""
+  if nulls is None:
+    nulls = bitarray([i in null_ids for i in ids], endian='little').tobytes()
+  columns = [TColumn(i64Val=TI64Column(values=list(ids), nulls=nulls)),
+             TColumn(binaryVal=TBinaryColumn(values=[str(i).encode() for i in ids],
+                                             nulls=b''))]
+  return TFetchResultsResp(status=TStatus(statusCode=TStatusCode.SUCCESS_STATUS),
+                           hasMoreRows=has_more_rows,
+                           results=TRowSet(startRowOffset=0, rows=[], columns=columns))
+
+
+class FakeHS2Service(object):
+  """Returns the given TFetchResultsResps, in order, from FetchResults. Exceptions in
+  'resps' are raised instead. Records the names of the threads that ran the fetches."""
+  def __init__(self, resps):
+    self.resps = list(resps)
+    self.num_fetches = 0
+    self.fetch_threads = []
+
+  def FetchResults(self, req):
+    self.num_fetches += 1
+    self.fetch_threads.append(threading.current_thread().name)
+    resp = self.resps.pop(0)
+    if isinstance(resp, Exception):
+      raise resp
+    return resp
+
+
+class FakeQueryHandle(object):
+  """Stand-in for the TOperationHandle of a query that returns a BIGINT and a BINARY
+  column."""
+  hasResultSet = True
+
+  def __init__(self, client):
+    types = [TTypeId.BIGINT_TYPE, TTypeId.BINARY_TYPE]
+    self.column_value_attrs = ('i64Val', 'binaryVal')
+    self.column_value_converters = tuple(
+        client.value_converter.get_column_converter(t) for t in types)
+
+
+class TestImpalaClient(BaseTestSuite):
+
+  def _get_connected_client(self, client_sock):
+    client = ImpalaBeeswaxClient(('localhost', '21000'), 1024, None)
+    client._socket = FakeTSocket(client_sock)
+    client.imp_service = FakeImpalaService()
+    client.connected = True
+    return client
+
+  def test_is_socket_closed_by_peer(self):
+    """The select() + MSG_PEEK check reports a socket as closed only once the peer has
+    closed it, not when it is idle or has unread data."""
+    client_sock, server_sock = socket.socketpair()
+    try:
+      client = self._get_connected_client(client_sock)
+      assert not client._is_socket_closed_by_peer()
+      server_sock.sendall(b'x')
+      assert not client._is_socket_closed_by_peer()
+      # The peeked byte is still there to be read.
+      assert client_sock.recv(1) == b'x'
+      server_sock.close()
+      assert client._is_socket_closed_by_peer()
+    finally:
+      client_sock.close()
+      server_sock.close()
+
+  def test_is_connected_detects_closed_peer(self):
+    """is_connected() reports a connection that the server closed as disconnected
+    without pinging, and pings an idle connection that is still open."""
+    client_sock, server_sock = socket.socketpair()
+    try:
+      client = self._get_connected_client(client_sock)
+      imp_service = client.imp_service
+      assert client.is_connected()
+      assert imp_service.num_pings == 1
+      # Within the grace period after a successful RPC there is no need to ping again.
+      assert client.is_connected()
+      assert imp_service.num_pings == 1
+      server_sock.close()
+      client._last_successful_rpc_time = None
+      assert not client.is_connected()
+      assert imp_service.num_pings == 1
+      assert not client.connected
+    finally:
+      client_sock.close()
+      server_sock.close()
+
+  def test_is_connected_after_failed_rpc(self):
+    """A failed RPC ends the grace period of the last successful one, so is_connected()
+    checks the connection again right away."""
+    client_sock, server_sock = socket.socketpair()
+    try:
+      client = self._get_connected_client(client_sock)
+      imp_service = client.imp_service
+      assert client.is_connected()
+      assert imp_service.num_pings == 1
+      with pytest.raises(DisconnectedException):
+        client._do_beeswax_rpc(imp_service.get_state, (None,))
+      assert client.is_connected()
+      assert imp_service.num_pings == 2
+    finally:
+      client_sock.close()
+      server_sock.close()
+
+
+class TestImpalaHS2ClientFetch(BaseTestSuite):
+
+  COLUMN_VALUE_ATTRS = ('i64Val', 'binaryVal')
+
+  def _get_client(self, resps, max_coalesced_fetches=4):
+    client = ImpalaHS2Client(('localhost', '21050'), 1024, None,
+                             max_coalesced_fetches=max_coalesced_fetches)
+    client.imp_service = FakeHS2Service(resps)
+    client.connected = True
+    return client
+
+  def _get_values(self, resp):
+    """Returns the BIGINT values of 'resp', with None for NULL, and the BINARY values."""
+    i64_col = resp.results.columns[0].i64Val
+    binary_col = resp.results.columns[1].binaryVal
+    is_null = bitarray(endian='little')
+    is_null.frombytes(i64_col.nulls)
+    ids = [None if i < len(is_null) and is_null[i] else v
+           for i, v in enumerate(i64_col.values)]
+    return ids, binary_col.values
+
+  def test_append_columns(self):
+    """Appending merges the values and null bitsets of two batches, for null bitsets
+    that don't hold exactly one bit per value and for batches without NULLs."""
+    client = self._get_client([])
+    # The bitset of a batch can be shorter than the number of values or be padded.
+    resp = make_fetch_resp(range(10), nulls=b'\x01')
+    more_resp = make_fetch_resp(range(10, 13), nulls=b'\x02\xff\xff')
+    client._append_columns(self.COLUMN_VALUE_ATTRS, resp.results.columns,
+                           more_resp.results.columns)
+    ids, binary_values = self._get_values(resp)
+    assert ids == [None] + list(range(1, 11)) + [None, 12]
+    assert binary_values == [str(i).encode() for i in range(13)]
+
+    # A batch without NULLs has an empty bitset, which must not shift the bits of the
+    # other batch.
+    resp = make_fetch_resp(range(3), nulls=b'')
+    client._append_columns(self.COLUMN_VALUE_ATTRS, resp.results.columns,
+                           make_fetch_resp(range(3, 5), null_ids=[4]).results.columns)
+    assert self._get_values(resp)[0] == [0, 1, 2, 3, None]
+    client._append_columns(self.COLUMN_VALUE_ATTRS, resp.results.columns,
+                           make_fetch_resp(range(5, 6), nulls=b'').results.columns)
+    assert self._get_values(resp)[0] == [0, 1, 2, 3, None, 5]
+
+    resp = make_fetch_resp(range(3))
+    client._append_columns(self.COLUMN_VALUE_ATTRS, resp.results.columns,
+                           make_fetch_resp(range(3, 6)).results.columns)
+    assert resp.results.columns[0].i64Val.nulls == b''
+    assert self._get_values(resp)[0] == list(range(6))
+
+  def test_coalesce_small_fetches(self):
+    """Small batches are merged until the server reports that there are no more rows."""
+    client = self._get_client([make_fetch_resp(range(10, 20), null_ids=[15]),
+                               make_fetch_resp(range(20, 25), has_more_rows=False)])
+    req = TFetchResultsReq(None, TFetchOrientation.FETCH_NEXT, 1024)
+    resp = make_fetch_resp(range(10), null_ids=[3])
+    last_resp = client._coalesce_small_fetches(
+        lambda req: client.imp_service.FetchResults(req), req, resp,
+        self.COLUMN_VALUE_ATTRS)
+    assert not last_resp.hasMoreRows
+    assert client.imp_service.num_fetches == 2
+    ids, binary_values = self._get_values(resp)
+    assert ids == [None if i in (3, 15) else i for i in range(25)]
+    assert binary_values == [str(i).encode() for i in range(25)]
+
+  def test_coalesce_small_fetches_limits(self):
+    """At most max_coalesced_fetches follow-up fetches are merged into a batch, and none
+    once MAX_COALESCE_TIME_S passed."""
+    client = self._get_client([make_fetch_resp(range(i, i + 10)) for i in (10, 20, 30)],
+                              max_coalesced_fetches=2)
+    req = TFetchResultsReq(None, TFetchOrientation.FETCH_NEXT, 1024)
+    resp = make_fetch_resp(range(10))
+    last_resp = client._coalesce_small_fetches(
+        lambda req: client.imp_service.FetchResults(req), req, resp,
+        self.COLUMN_VALUE_ATTRS)
+    assert last_resp.hasMoreRows
+    assert self._get_values(resp)[0] == list(range(30))
+
+    client.MAX_COALESCE_TIME_S = 0
+    resp = make_fetch_resp(range(10))
+    client._coalesce_small_fetches(lambda req: client.imp_service.FetchResults(req), req,
+                                   resp, self.COLUMN_VALUE_ATTRS)
+    assert self._get_values(resp)[0] == list(range(10))
+    assert client.imp_service.num_fetches == 2
+
+  def test_fetch_does_not_coalesce_first_batch(self):
+    """The first batch is returned as soon as it arrives, later small batches are
+    merged."""
+    client = self._get_client([make_fetch_resp(range(i, i + 10), has_more_rows=i < 30)
+                               for i in (0, 10, 20, 30)])
+    batches = list(client.fetch(FakeQueryHandle(client)))
+    assert [len(batch) for batch in batches] == [10, 30]
+    assert [row for batch in batches for row in batch] == \
+        [[str(i), str(i)] for i in range(40)]
+
+  def test_fetch_prefetch_next_batch(self, monkeypatch):
+    """Only a caller that asks for it gets the next batch fetched in the background. The
+    errors of a background fetch are logged and raised on the caller's thread."""
+    resps = [make_fetch_resp(range(i, i + 10)) for i in (0, 10)]
+    client = self._get_client(resps + [make_fetch_resp([], has_more_rows=False)],
+                              max_coalesced_fetches=0)
+    assert len(list(client.fetch(FakeQueryHandle(client)))) == 3
+    assert set(client.imp_service.fetch_threads) == set([threading.current_thread().name])
+
+    logging_threads = []
+    monkeypatch.setattr(impala_client, 'log_exception_with_timestamp',
+                        lambda *args: logging_threads.append(threading.current_thread()))
+    client = self._get_client(resps + [TTransportException(message="connection reset")],
+                              max_coalesced_fetches=0)
+    batches = client.fetch(FakeQueryHandle(client), prefetch_next_batch=True)
+    assert len(next(batches)) == 10
+    assert len(next(batches)) == 10
+    with pytest.raises(DisconnectedException):
+      next(batches)
+    assert client.imp_service.fetch_threads[0] == threading.current_thread().name
+    assert threading.current_thread().name not in client.imp_service.fetch_threads[1:]
+    assert logging_threads == [threading.current_thread()]
@@ -0,0 +1,148 @@
+#!/usr/bin/env impala-python
+# -*- coding: utf-8 -*-
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import absolute_import, division, print_function
+from http.client import HTTPMessage, RemoteDisconnected
+import socket
+
+import pytest
+
+from impala_shell import ImpalaHttpClient as http_client_module
+from impala_shell.ImpalaHttpClient import ImpalaHttpClient
+from tests.common.base_test_suite import BaseTestSuite
+
+
+class FakeResponse(object):
+  """Minimal stand-in for http.client.HTTPResponse."""
+  def __init__(self, body=b''):
+    self.status = 200
+    self.reason = 'OK'
+    self.msg = HTTPMessage()
+    self.body = body
+
+  def read(self, sz=None):
+    body, self.body = self.body, b''
+    return body
+
+  def isclosed(self):
+    return not self.body
+
+
+class FakeConnection(object):
+  """Stand-in for http.client.HTTPConnection. 'failures' is shared by all the
+  connections of a test and lists the errors to raise, in order, as tuples of
+  (method name, exception). Every request that reaches endheaders() is recorded in
+  'sent', which is also shared. 'sock' is the client end of a socket pair whose server
+  end is 'server_sock'."""
+  def __init__(self, failures, sent):
+    self.failures = failures
+    self.sent = sent
+    self.sock, self.server_sock = socket.socketpair()
+
+  def _maybe_fail(self, method):
+    if self.failures and self.failures[0][0] == method:
+      raise self.failures.pop(0)[1]
+
+  def putrequest(self, method, path):
+    pass
+
+  def putheader(self, key, val):
+    pass
+
+  def endheaders(self, data):
+    self._maybe_fail('endheaders')
+    self.sent.append(data)
+
+  def getresponse(self):
+    self._maybe_fail('getresponse')
+    return FakeResponse()
+
+  def close(self):
+    self.sock.close()
+    self.server_sock.close()
+
+
+class TestImpalaHttpClient(BaseTestSuite):
+
+  def _get_client(self, monkeypatch, failures, sent):
+    connections = []
+
+    def make_connection(*args, **kwargs):
+      connections.append(FakeConnection(failures, sent))
+      return connections[-1]
+    monkeypatch.setattr(http_client_module.http_client, 'HTTPConnection',
+                        make_connection)
+    # The client opens the connection when it sends the first request.
+    client = ImpalaHttpClient('http://localhost:28000/cliservice')
+    return client, connections
+
+  def _send(self, client, data):
+    client.write(data)
+    client.flush()
+
+  def test_reconnect_on_idle_connection_closed_by_server(self, monkeypatch):
+    """A reused connection that the server closed while it was idle is replaced before
+    the next request is sent on it."""
+    sent = []
+    client, connections = self._get_client(monkeypatch, [], sent)
+    self._send(client, b'first')
+    assert not client.isClosedByPeer()
+    connections[0].server_sock.close()
+    assert client.isClosedByPeer()
+    self._send(client, b'second')
+    assert len(connections) == 2
+    assert sent == [b'first', b'second']
+    assert client.code == 200
+
+  def test_resend_on_send_failure(self, monkeypatch):
+    """A request that could not be sent on a reused connection is sent again on a new
+    connection."""
+    sent = []
+    client, connections = self._get_client(monkeypatch, [], sent)
+    self._send(client, b'first')
+    connections[0].failures.append(('endheaders', socket.error('broken pipe')))
+    self._send(client, b'second')
+    assert len(connections) == 2
+    assert sent == [b'first', b'second']
+    assert client.code == 200
+
+  def test_no_resend_after_request_reached_server(self, monkeypatch):
+    """Errors while reading the response of a reused connection may happen after the
+    server ran the request, so they are raised instead of sending it again, even if the
+    server closed the connection without answering."""
+    for error in [socket.error('reset'), RemoteDisconnected('closed')]:
+      sent = []
+      client, connections = self._get_client(monkeypatch, [], sent)
+      self._send(client, b'first')
+      connections[0].failures.append(('getresponse', error))
+      with pytest.raises(type(error)):
+        self._send(client, b'second')
+      assert len(connections) == 1
+      assert sent == [b'first', b'second']
+
+  def test_no_resend_on_new_connection(self, monkeypatch):
+    """A request on a connection that was just opened is never sent twice."""
+    sent = []
+    client, connections = self._get_client(
+        monkeypatch, [('getresponse', RemoteDisconnected('closed'))], sent)
+    with pytest.raises(RemoteDisconnected):
+      self._send(client, b'first')
+    assert len(connections) == 1
+    assert sent == [b'first']
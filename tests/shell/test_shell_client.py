@@ -20,6 +20,8 @@
 
 from __future__ import absolute_import, division, print_function
 
+import pytest
+
 from impala_shell.impala_client import ImpalaBeeswaxClient, ImpalaHS2Client
 from tests.common.impala_test_suite import ImpalaTestSuite
 from tests.common.test_dimensions import (
@@ -53,7 +55,7 @@ class TestShellClient(ImpalaTestSuite):
     num_rows = 100
     batch_size = 10
     query_options = {'batch_size': str(batch_size), 'spool_query_results': 'false'}
-    client = self.__get_shell_client(vector)
+    client = self.__get_shell_client(vector, max_coalesced_fetches=0)
 
     try:
       client.connect()
@@ -64,6 +66,34 @@ class TestShellClient(ImpalaTestSuite):
       if handle is not None: client.close_query(handle)
       client.close_connection()
 
+  def test_fetch_coalesces_small_batches(self, vector):
+    """Tests that when result spooling is disabled and the server returns batches much
+    smaller than the fetch size, the HS2 clients issue follow-up fetches and merge the
+    results into larger batches. The first batch is returned as is."""
+    if vector.get_value("protocol") == "beeswax":
+      pytest.skip("Fetch coalescing is only implemented for the HS2 protocols")
+    handle = None
+    num_rows = 100
+    batch_size = 10
+    max_coalesced_fetches = 4
+    query_options = {'batch_size': str(batch_size), 'spool_query_results': 'false'}
+    client = self.__get_shell_client(vector, max_coalesced_fetches=max_coalesced_fetches)
+
+    try:
+      client.connect()
+      handle = client.execute_query(
+          "select * from functional.alltypes limit {0}".format(num_rows), query_options)
+      batch_lens = [len(fetch_batch) for fetch_batch in client.fetch(handle)]
+      assert batch_lens[0] == batch_size
+      assert sum(batch_lens) == num_rows
+      # Follow-up fetches stop after a time limit, so a slow server may return fewer
+      # rows per batch than max_coalesced_fetches allows.
+      assert max(batch_lens) <= batch_size * (max_coalesced_fetches + 1)
+      assert len(batch_lens) < num_rows // batch_size
+    finally:
+      if handle is not None: client.close_query(handle)
+      client.close_connection()
+
   def test_fetch_size_result_spooling(self, vector):
     """Tests that when result spooling is enabled, that the exact fetch_size is honored
     even if a small batch_size is configured."""
@@ -93,14 +123,16 @@ class TestShellClient(ImpalaTestSuite):
       if num_batches_count == num_batches: break
     assert num_batches_count == num_batches
 
-  def __get_shell_client(self, vector, fetch_size=1024):
+  def __get_shell_client(self, vector, fetch_size=1024, max_coalesced_fetches=4):
     """Returns the client specified by the protocol in the given vector."""
     impalad = get_impalad_host_port(vector).split(":")
     protocol = vector.get_value("protocol")
     if protocol == 'hs2':
-      return ImpalaHS2Client(impalad, fetch_size, None)
+      return ImpalaHS2Client(impalad, fetch_size, None,
+              max_coalesced_fetches=max_coalesced_fetches)
     elif protocol == 'hs2-http':
       return ImpalaHS2Client(impalad, fetch_size, None,
-              use_http_base_transport=True, http_path='cliservice')
+              use_http_base_transport=True, http_path='cliservice',
+              max_coalesced_fetches=max_coalesced_fetches)
     elif protocol == 'beeswax':
       return ImpalaBeeswaxClient(impalad, fetch_size, None)